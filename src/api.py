@@ -1,14 +1,22 @@
 """DrChrono API operations: patient lookup, duplicate detection, document upload."""
 
+import contextvars
+import datetime
+import email.utils
 import json
+import os
 import random
+import sqlite3
 import threading
 import time
 from pathlib import Path
 
 import requests
+from requests_toolbelt import MultipartEncoder
 
-from src.auth import DRCHRONO_BASE, api_headers
+from src import config as app_config
+from src.auth import DRCHRONO_BASE
+from src.http_client import session
 from src.types import (
     PatientLookupResult,
     PatientLookupStatus,
@@ -25,6 +33,20 @@ MAX_RETRIES = 3
 BACKOFF_BASE = 2  # seconds — multiplied by 2^attempt + jitter
 BACKOFF_MAX = 30  # cap on any single wait
 
+# Max HTTP requests in flight at once across all upload workers
+MAX_CONCURRENT_REQUESTS = 4
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def _print_notice(message: str) -> None:
+    print(f"  {message}")
+
+
+# Where _request_with_retry reports its backoff waits. Callers that buffer
+# their own output (the batch processor's per-file log) set this for the
+# current thread so the notice lands in that buffer instead of stdout.
+retry_log: contextvars.ContextVar = contextvars.ContextVar("retry_log", default=_print_notice)
+
 
 class RateLimitError(Exception):
     """Raised when the API returns 429 and all retries are exhausted.
@@ -40,32 +62,59 @@ class RateLimitError(Exception):
         self.is_app_limit = is_app_limit
 
 
-def _request_with_retry(method: str, url: str, **kwargs) -> requests.Response:
+def _parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header, or None if absent or unreadable.
+
+    The header is either delay-seconds ("120") or an HTTP-date
+    ("Wed, 21 Oct 2026 07:28:00 GMT"); dates in the past mean no wait.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def _request_with_retry(method: str, url: str, make_body=None, **kwargs) -> requests.Response:
     """Execute an HTTP request with retry + exponential backoff on 429 responses.
 
-    For non-429 errors this behaves identically to ``requests.request``.
+    For non-429 errors this behaves identically to ``session.request``.
+    Concurrent callers share MAX_CONCURRENT_REQUESTS slots; backoff sleeps
+    happen outside the slot so a throttled worker doesn't block the others.
+
+    Streaming bodies can only be sent once, so callers that upload pass
+    ``make_body`` — a zero-arg callable returning ``(data, content_type)``
+    that is invoked fresh for every attempt.
     """
     for attempt in range(MAX_RETRIES + 1):
-        resp = requests.request(method, url, **kwargs)
+        attempt_kwargs = kwargs
+        if make_body is not None:
+            data, content_type = make_body()
+            headers = {**kwargs.get("headers", {}), "Content-Type": content_type}
+            attempt_kwargs = {**kwargs, "data": data, "headers": headers}
+        with _request_slots:
+            resp = session.request(method, url, **attempt_kwargs)
 
         if resp.status_code != 429:
             return resp
 
         # Determine how long to wait
-        retry_after = resp.headers.get("Retry-After")
-        if retry_after is not None:
-            try:
-                wait = float(retry_after)
-            except ValueError:
-                wait = BACKOFF_BASE * (2 ** attempt)
-        else:
-            wait = BACKOFF_BASE * (2 ** attempt)
+        retry_after = _parse_retry_after(resp.headers.get("Retry-After"))
+        wait = retry_after if retry_after is not None else BACKOFF_BASE * (2 ** attempt)
 
         wait = min(wait, BACKOFF_MAX)
         wait += random.uniform(0, 1)  # jitter
 
         # Detect application-level limit (large Retry-After typically means hourly reset)
-        is_app_limit = retry_after is not None and float(retry_after) > 60
+        is_app_limit = retry_after is not None and retry_after > 60
 
         if attempt == MAX_RETRIES:
             msg = (
@@ -77,9 +126,9 @@ def _request_with_retry(method: str, url: str, **kwargs) -> requests.Response:
                     "DrChrono application rate limit reached (500 requests/hour). "
                     "Please wait until the top of the hour and try again."
                 )
-            raise RateLimitError(msg, retry_after=float(retry_after) if retry_after else None, is_app_limit=is_app_limit)
+            raise RateLimitError(msg, retry_after=retry_after, is_app_limit=is_app_limit)
 
-        print(f"  [RATE LIMIT] 429 received — waiting {wait:.1f}s before retry {attempt + 1}/{MAX_RETRIES}…")
+        retry_log.get()(f"[RATE LIMIT] 429 received — waiting {wait:.1f}s before retry {attempt + 1}/{MAX_RETRIES}…")
         time.sleep(wait)
 
     # Should not reach here, but just in case:
@@ -108,7 +157,6 @@ def find_patient(config, last_name, first_name, middle_initial=None, dob=None) -
     resp = _request_with_retry(
         "GET",
         f"{DRCHRONO_BASE}/api/patients",
-        headers=api_headers(config),
         params={"last_name": last_name, "first_name": first_name},
     )
     resp.raise_for_status()
@@ -171,49 +219,227 @@ def find_patient(config, last_name, first_name, middle_initial=None, dob=None) -
 # Duplicate detection
 # ---------------------------------------------------------------------------
 
-_documents_cache: dict[int, list[dict]] = {}
+# patient_id -> (documents, {(date, description, metatag), ...}) for O(1) duplicate probes
+_documents_cache: dict[int, tuple[list[dict], set[tuple[str, str, str]]]] = {}
 _documents_cache_lock = threading.Lock()
 
+# Larger pages mean fewer round-trips for patients with long document histories
+_DOCUMENTS_PAGE_SIZE = 200
 
-def get_patient_documents(config, patient_id: int) -> list[dict]:
-    """Fetch all existing documents for a patient (cached per run). Thread-safe."""
+
+def _index_documents(documents: list[dict]) -> set[tuple[str, str, str]]:
+    """Build the set of (date, description, metatag) triples present in ``documents``."""
+    index: set[tuple[str, str, str]] = set()
+    for doc in documents:
+        raw_tags = doc.get("metatags") or "[]"
+        try:
+            tags = json.loads(raw_tags) if isinstance(raw_tags, str) else raw_tags
+        except (json.JSONDecodeError, TypeError):
+            tags = []
+        if not isinstance(tags, list):
+            continue
+        for tag in tags:
+            # A malformed entry (e.g. a nested list) can't match a tag name and isn't hashable
+            if isinstance(tag, str):
+                index.add((doc.get("date"), doc.get("description"), tag))
+    return index
+
+
+def _cache_documents(patient_id: int, documents: list[dict]) -> tuple[list[dict], set[tuple[str, str, str]]]:
+    """Store a patient's documents and their duplicate index; first writer wins."""
+    entry = (documents, _index_documents(documents))
+    with _documents_cache_lock:
+        return _documents_cache.setdefault(patient_id, entry)
+
+
+# ---------------------------------------------------------------------------
+# Persistent document-list cache (conditional GET across runs)
+# ---------------------------------------------------------------------------
+
+_disk_cache_lock = threading.Lock()
+
+# Saved lists older than this are refetched in full and pruned from disk
+DOCUMENTS_CACHE_MAX_AGE = 7 * 24 * 3600  # seconds
+
+# The only document fields duplicate detection reads; nothing else is written to disk
+_CACHED_DOCUMENT_FIELDS = ("date", "description", "metatags")
+
+
+# Stored in the file's user_version; bump it when the table layout changes
+_DISK_CACHE_SCHEMA_VERSION = 1
+
+
+def _disk_cache_connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(app_config.DOCUMENTS_CACHE_FILE)
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version < _DISK_CACHE_SCHEMA_VERSION:
+        with conn:
+            # Version 0 kept whole document records in a "documents" table
+            conn.execute("DROP TABLE IF EXISTS documents")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS document_keys ("
+                "patient_id INTEGER PRIMARY KEY, etag TEXT, last_modified TEXT, "
+                "stored_at REAL NOT NULL, docs TEXT NOT NULL)"
+            )
+            conn.execute(f"PRAGMA user_version = {_DISK_CACHE_SCHEMA_VERSION}")
+    return conn
+
+
+def _load_cached_documents(patient_id: int) -> tuple[str | None, str | None, list[dict]] | None:
+    """Return (etag, last_modified, documents) saved by a recent run, or None.
+
+    The documents carry only _CACHED_DOCUMENT_FIELDS.
+    """
+    try:
+        with _disk_cache_lock:
+            conn = _disk_cache_connect()
+            try:
+                row = conn.execute(
+                    "SELECT etag, last_modified, docs FROM document_keys "
+                    "WHERE patient_id = ? AND stored_at >= ?",
+                    (patient_id, time.time() - DOCUMENTS_CACHE_MAX_AGE),
+                ).fetchone()
+            finally:
+                conn.close()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+    except (sqlite3.Error, json.JSONDecodeError):
+        return None
+
+
+def _store_cached_documents(patient_id: int, etag: str | None, last_modified: str | None,
+                            documents: list[dict]) -> None:
+    """Persist the duplicate-check fields of a patient's documents with their validators.
+
+    Also prunes entries past DOCUMENTS_CACHE_MAX_AGE. Best effort.
+    """
+    keys = [{field: doc.get(field) for field in _CACHED_DOCUMENT_FIELDS} for doc in documents]
+    now = time.time()
+    try:
+        with _disk_cache_lock:
+            conn = _disk_cache_connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM document_keys WHERE stored_at < ?", (now - DOCUMENTS_CACHE_MAX_AGE,))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO document_keys VALUES (?, ?, ?, ?, ?)",
+                        (patient_id, etag, last_modified, now, json.dumps(keys)),
+                    )
+            finally:
+                conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def clear_documents_cache() -> None:
+    """Delete the document-list cache saved by previous runs."""
+    with _disk_cache_lock:
+        try:
+            os.remove(app_config.DOCUMENTS_CACHE_FILE)
+        except FileNotFoundError:
+            pass
+
+
+def _get_documents_entry(config, patient_id: int) -> tuple[list[dict], set[tuple[str, str, str]]]:
     with _documents_cache_lock:
         if patient_id in _documents_cache:
             return _documents_cache[patient_id]
 
+    # Revalidate the list saved by a previous run so an unchanged patient costs a 304
+    conditional: dict[str, str] = {}
+    cached = _load_cached_documents(patient_id)
+    if cached is not None:
+        etag, last_modified, cached_docs = cached
+        if etag:
+            conditional["If-None-Match"] = etag
+        if last_modified:
+            conditional["If-Modified-Since"] = last_modified
+
+    url = f"{DRCHRONO_BASE}/api/documents"
+    params = {"patient": patient_id, "page_size": _DOCUMENTS_PAGE_SIZE}
+    resp = _request_with_retry("GET", url, headers=conditional, params=params)
+    if resp.status_code == 304 and cached is not None:
+        return _cache_documents(patient_id, cached_docs)
+
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
     documents: list[dict] = []
-    url: str | None = f"{DRCHRONO_BASE}/api/documents"
-    params: dict = {"patient": patient_id}
-
-    while url:
-        resp = _request_with_retry("GET", url, headers=api_headers(config), params=params)
+    pages = 0
+    while True:
         resp.raise_for_status()
         data = resp.json()
         documents.extend(data.get("results", data.get("data", [])))
-        url = data.get("next")
-        params = {}
+        pages += 1
+        next_url = data.get("next")
+        if not next_url:
+            break
+        resp = _request_with_retry("GET", next_url)
 
-    with _documents_cache_lock:
-        _documents_cache.setdefault(patient_id, documents)
-    return documents
+    # Validators only cover the first page, so a multi-page list can't be trusted on a 304
+    if pages == 1 and (etag or last_modified):
+        _store_cached_documents(patient_id, etag, last_modified, documents)
+
+    return _cache_documents(patient_id, documents)
+
+
+def get_patient_documents(config, patient_id: int) -> list[dict]:
+    """Fetch all existing documents for a patient (cached per run). Thread-safe.
+
+    A list revalidated from the on-disk cache carries only the fields
+    duplicate detection needs (date, description, metatags).
+    """
+    return _get_documents_entry(config, patient_id)[0]
+
+
+# Small page for a filtered probe; more matches than this means "fall back to the full list"
+_PROBE_PAGE_SIZE = 10
+
+# Flipped to False the first time the API rejects the date filter
+_document_filter_supported = True
+
+
+def find_matching_documents(config, patient_id: int, date: str, description: str) -> list[dict] | None:
+    """Fetch only the patient's documents dated ``date`` with a matching description.
+
+    Returns None when the server-side filter can't answer the question (the
+    API rejected it, or the result spans more than one page), in which case
+    the caller should use the full document list instead.
+    """
+    global _document_filter_supported
+    if not _document_filter_supported:
+        return None
+
+    resp = _request_with_retry(
+        "GET",
+        f"{DRCHRONO_BASE}/api/documents",
+        params={"patient": patient_id, "date_range": f"{date}/{date}", "page_size": _PROBE_PAGE_SIZE},
+    )
+    if resp.status_code == 400:
+        _document_filter_supported = False
+        return None
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get("next"):
+        return None
+    results = data.get("results", data.get("data", []))
+    return [doc for doc in results if doc.get("date") == date and doc.get("description") == description]
 
 
 def is_duplicate(config, patient_id: int, date: str, description: str, metatag: str) -> bool:
-    """Check if a document with the same date, description, and metatag already exists."""
-    existing = get_patient_documents(config, patient_id)
-    for doc in existing:
-        if doc.get("date") != date:
-            continue
-        if doc.get("description") != description:
-            continue
-        raw_tags = doc.get("metatags") or "[]"
-        try:
-            tags = json.loads(raw_tags) if isinstance(raw_tags, str) else raw_tags
-        except (json.JSONDecodeError, TypeError):
-            tags = []
-        if metatag in tags:
-            return True
-    return False
+    """Check if a document with the same date, description, and metatag already exists.
+
+    Uses the cached full document list when there is one; otherwise tries a
+    single filtered query before falling back to fetching every document.
+    """
+    with _documents_cache_lock:
+        entry = _documents_cache.get(patient_id)
+    if entry is None:
+        matches = find_matching_documents(config, patient_id, date, description)
+        if matches is not None:
+            return (date, description, metatag) in _index_documents(matches)
+        entry = _get_documents_entry(config, patient_id)
+    return (date, description, metatag) in entry[1]
 
 
 # ---------------------------------------------------------------------------
@@ -223,20 +449,29 @@ def is_duplicate(config, patient_id: int, date: str, description: str, metatag:
 def upload_document(config, file_path, patient_id, doctor_id, date, description, metatag) -> UploadResult:
     """Upload a single document to DrChrono."""
     metatags_json = json.dumps([metatag])
+    filename = Path(file_path).name
 
     with open(file_path, "rb") as f:
-        resp = _request_with_retry(
-            "POST",
-            f"{DRCHRONO_BASE}/api/documents",
-            headers=api_headers(config),
-            data={
+        def _encode():
+            # Stream the file from disk instead of buffering the whole multipart body;
+            # rewind so a retried attempt sends the full document again.
+            f.seek(0)
+            form = {
                 "patient": patient_id,
                 "doctor": doctor_id,
                 "date": date,
                 "description": description,
                 "metatags": metatags_json,
-            },
-            files={"document": (Path(file_path).name, f)},
+            }
+            fields = {k: str(v) for k, v in form.items() if v is not None}
+            fields["document"] = (filename, f, "application/octet-stream")
+            encoder = MultipartEncoder(fields=fields)
+            return encoder, encoder.content_type
+
+        resp = _request_with_retry(
+            "POST",
+            f"{DRCHRONO_BASE}/api/documents",
+            make_body=_encode,
         )
 
     if resp.status_code == 201:
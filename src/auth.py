@@ -1,18 +1,24 @@
 """OAuth2 authorization flow for DrChrono API."""
 
+import socket
 import sys
 import threading
+import time
 import urllib.parse
 import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
 
 import requests
 
 from src.credential_store import get as cred_get, set_many as cred_set_many
+from src.http_client import session
 
 DRCHRONO_BASE = "https://app.drchrono.com"
 REDIRECT_PORT = 8585
 REDIRECT_URI = f"http://localhost:{REDIRECT_PORT}/callback"
+# Refresh this many seconds before the access token expires so in-flight calls never 401
+_TOKEN_SKEW = 60.0
+_refresh_lock = threading.Lock()
+
 SCOPED_PERMISSIONS = [
     "patients:summary:read", 
     "patients:read",
@@ -22,35 +28,50 @@ SCOPED_PERMISSIONS = [
 ]
 
 
-class _CallbackHandler(BaseHTTPRequestHandler):
-    """Handles the OAuth redirect and captures the authorization code."""
+# Cap on how much of the browser's redirect request we read before giving up on it
+_MAX_CALLBACK_REQUEST = 65536
+
+
+def _listen_for_callback(port: int = REDIRECT_PORT) -> socket.socket:
+    """Bind the redirect port before the browser opens so the callback can't be missed."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("localhost", port))
+    sock.listen(1)
+    return sock
 
-    auth_code = None
 
-    def do_GET(self):
-        query = urllib.parse.urlparse(self.path).query
-        params = urllib.parse.parse_qs(query)
+def _accept_callback(sock: socket.socket) -> str | None:
+    """Accept the OAuth redirect on ``sock`` and return the authorization code, if any."""
+    conn, _ = sock.accept()
+    with conn:
+        request = b""
+        while b"\r\n\r\n" not in request and len(request) < _MAX_CALLBACK_REQUEST:
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            request += chunk
+
+        # Request line: "GET /callback?code=... HTTP/1.1"
+        parts = request.split(b" ", 2)
+        path = parts[1].decode("latin-1") if len(parts) > 1 else ""
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
 
         if "error" in params:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Authorization denied. You can close this tab.")
-            _CallbackHandler.auth_code = None
+            status, body, code = "400 Bad Request", b"Authorization denied. You can close this tab.", None
         elif "code" in params:
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"Authorization successful! You can close this tab.")
-            _CallbackHandler.auth_code = params["code"][0]
+            status, body, code = "200 OK", b"Authorization successful! You can close this tab.", params["code"][0]
         else:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Unexpected response. You can close this tab.")
-            _CallbackHandler.auth_code = None
+            status, body, code = "400 Bad Request", b"Unexpected response. You can close this tab.", None
+
+        header = f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        conn.sendall(header.encode("ascii") + body)
+    return code
 
-        threading.Thread(target=self.server.shutdown, daemon=True).start()
 
-    def log_message(self, format, *args):
-        pass
+def _apply_auth(config):
+    """Attach the current bearer token to the shared session so API calls needn't pass headers."""
+    session.headers["Authorization"] = f"Bearer {config['access_token']}"
 
 
 def _store_tokens(config, data):
@@ -61,6 +82,13 @@ def _store_tokens(config, data):
     })
     config["access_token"] = data["access_token"]
     config["refresh_token"] = data["refresh_token"]
+    if "expires_in" in data:
+        # Epoch seconds, compared directly by the per-file expiry check
+        config["expires_at_epoch"] = time.time() + data["expires_in"]
+    else:
+        # don't trust a stale expiry from an older config.json
+        config.pop("expires_at_epoch", None)
+    _apply_auth(config)
 
 
 def authorize(config):
@@ -78,21 +106,17 @@ def authorize(config):
         f"&client_id={client_id_encoded}&scope={scopes}"
     )
 
-    _CallbackHandler.auth_code = None
-    server = HTTPServer(("localhost", REDIRECT_PORT), _CallbackHandler)
+    with _listen_for_callback() as sock:
+        print("Opening browser for DrChrono authorization...")
+        webbrowser.open(url)
+        print("Waiting for authorization (complete the login in your browser)...")
+        code = _accept_callback(sock)
 
-    print("Opening browser for DrChrono authorization...")
-    webbrowser.open(url)
-    print("Waiting for authorization (complete the login in your browser)...")
-    server.handle_request()
-    server.server_close()
-
-    code = _CallbackHandler.auth_code
     if not code:
         print("Authorization failed or was cancelled.")
         sys.exit(1)
 
-    resp = requests.post(f"{DRCHRONO_BASE}/o/token/", data={
+    resp = session.post(f"{DRCHRONO_BASE}/o/token/", data={
         "code": code,
         "grant_type": "authorization_code",
         "redirect_uri": REDIRECT_URI,
@@ -107,7 +131,7 @@ def authorize(config):
 
 def refresh_token(config):
     """Refresh an expired access token."""
-    resp = requests.post(f"{DRCHRONO_BASE}/o/token/", data={
+    resp = session.post(f"{DRCHRONO_BASE}/o/token/", data={
         "refresh_token": cred_get("refresh_token") or config["refresh_token"],
         "grant_type": "refresh_token",
         "client_id": cred_get("client_id") or config["client_id"],
@@ -118,17 +142,36 @@ def refresh_token(config):
     return config
 
 
+def _token_expiring(config) -> bool:
+    """True when the access token expires within _TOKEN_SKEW (or its expiry is unknown)."""
+    expires_at = config.get("expires_at_epoch")
+    if expires_at is None:
+        return True
+    return time.time() + _TOKEN_SKEW >= expires_at
+
+
 def ensure_auth(config):
     """Ensure we have a valid access token by refreshing or re-authorizing."""
-    rt = cred_get("refresh_token") or config.get("refresh_token")
-    if rt:
-        try:
-            return refresh_token(config)
-        except requests.HTTPError:
-            print("Token refresh failed, re-authorizing...")
-    return authorize(config)
-
-
-def api_headers(config):
-    token = cred_get("access_token") or config.get("access_token")
-    return {"Authorization": f"Bearer {token}"}
+    with _refresh_lock:
+        rt = cred_get("refresh_token") or config.get("refresh_token")
+        if rt:
+            try:
+                return refresh_token(config)
+            except requests.HTTPError:
+                print("Token refresh failed, re-authorizing...")
+        return authorize(config)
+
+
+def refresh_if_expiring(config):
+    """Refresh the access token mid-run if it is about to expire.
+
+    Safe to call from every worker: the first caller refreshes while the
+    others wait on the lock and then see the new expiry. No-op when the
+    expiry is unknown (e.g. the token didn't come from this run).
+    """
+    if config.get("expires_at_epoch") is None or not _token_expiring(config):
+        return config
+    with _refresh_lock:
+        if _token_expiring(config):
+            refresh_token(config)
+    return config
@@ -3,7 +3,9 @@
 import json
 import os
 import platform
+import stat
 import sys
+import tempfile
 
 if getattr(sys, "frozen", False):
     # PyInstaller bundle — sys.executable is the actual binary path
@@ -30,6 +32,7 @@ def _data_dir() -> str:
 DATA_DIR = _data_dir()
 CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
 SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
+DOCUMENTS_CACHE_FILE = os.path.join(DATA_DIR, "documents_cache.sqlite3")
 
 
 def _migrate_file(filename: str) -> None:
@@ -50,8 +53,28 @@ def load_config():
 
 
 def save_config(config):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=2)
+    # Write a sibling temp file and swap it in, so a crash mid-write never
+    # leaves a truncated config.json (it may hold fallback credentials).
+    # mkstemp gives each writer its own owner-only file; an existing
+    # config.json keeps its mode across the swap.
+    try:
+        mode = stat.S_IMODE(os.stat(CONFIG_FILE).st_mode)
+    except FileNotFoundError:
+        mode = 0o600
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(CONFIG_FILE), prefix=".config.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(config, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, CONFIG_FILE)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 def load_metatags():
@@ -83,7 +106,7 @@ def save_settings(settings):
 
 
 def ensure_credentials(config):
-    from src.credential_store import get as cred_get, set as cred_set
+    from src.credential_store import get as cred_get, set_many as cred_set_many
     client_id = cred_get("client_id") or config.get("client_id")
     client_secret = cred_get("client_secret") or config.get("client_secret")
     if not client_id or not client_secret:
@@ -94,8 +117,7 @@ def ensure_credentials(config):
         print("  4. Copy the Client ID and Client Secret from the app details\n")
         client_id = input("Client ID: ").strip()
         client_secret = input("Client Secret: ").strip()
-        cred_set("client_id", client_id)
-        cred_set("client_secret", client_secret)
+        cred_set_many({"client_id": client_id, "client_secret": client_secret})
     config["client_id"] = client_id
     config["client_secret"] = client_secret
     return config
@@ -16,8 +16,23 @@ SESSION_ONLY_KEYS = frozenset({"access_token"})
 ALL_KEYS = CREDENTIAL_KEYS | SESSION_ONLY_KEYS
 
 _keyring_available: bool | None = None
+_keyring_mod = None  # the imported keyring module, bound on first use
+# (raw keyring string, parsed blob) from the last read/write — skips re-parsing an unchanged blob
+_blob_cache: tuple[str, dict[str, str]] | None = None
 _session_cache: dict[str, str] | None = None
 
+# config.json path -> ((mtime_ns, size), parsed contents) for the keyring-less fallback
+_config_cache: dict[str, tuple[tuple[int, int], dict]] = {}
+
+
+def _keyring():
+    """Return the keyring module, importing it only the first time."""
+    global _keyring_mod
+    if _keyring_mod is None:
+        import keyring
+        _keyring_mod = keyring
+    return _keyring_mod
+
 
 def _check_keyring() -> bool:
     """Check if keyring is importable and functional (cached after first call)."""
@@ -25,8 +40,7 @@ def _check_keyring() -> bool:
     if _keyring_available is not None:
         return _keyring_available
     try:
-        import keyring as kr
-        kr.get_password(SERVICE_NAME, CREDENTIAL_ACCOUNT)
+        _keyring().get_password(SERVICE_NAME, CREDENTIAL_ACCOUNT)
         _keyring_available = True
     except Exception:
         _keyring_available = False
@@ -42,20 +56,62 @@ def _check_keyring() -> bool:
 
 def _read_blob() -> dict[str, str]:
     """Read the single JSON credential blob from keyring."""
-    import keyring as kr
-    raw = kr.get_password(SERVICE_NAME, CREDENTIAL_ACCOUNT)
+    global _blob_cache
+    raw = _keyring().get_password(SERVICE_NAME, CREDENTIAL_ACCOUNT)
     if not raw:
         return {}
+    if _blob_cache is not None and _blob_cache[0] == raw:
+        return dict(_blob_cache[1])
     try:
-        return json.loads(raw)
+        blob = json.loads(raw)
     except json.JSONDecodeError:
         return {}
+    _blob_cache = (raw, blob)
+    return dict(blob)
 
 
 def _write_blob(data: dict[str, str]) -> None:
     """Write the credential dict as a JSON blob to keyring."""
-    import keyring as kr
-    kr.set_password(SERVICE_NAME, CREDENTIAL_ACCOUNT, json.dumps(data))
+    global _blob_cache
+    raw = json.dumps(data)
+    _keyring().set_password(SERVICE_NAME, CREDENTIAL_ACCOUNT, raw)
+    _blob_cache = (raw, dict(data))
+
+
+def _file_version(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _load_config() -> dict:
+    """Read config.json, reusing the parsed copy while the file is unchanged on disk.
+
+    The returned dict is shared with the cache — copy it before mutating.
+    """
+    from src import config
+    path = config.CONFIG_FILE
+    version = _file_version(path)
+    cached = _config_cache.get(path)
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+    cfg = config.load_config()
+    version = _file_version(path)  # load_config may have migrated the file into place
+    if version is not None:
+        _config_cache[path] = (version, cfg)
+    return cfg
+
+
+def _save_config(cfg: dict) -> None:
+    """Write config.json and keep the read cache in step with what's on disk."""
+    from src import config
+    path = config.CONFIG_FILE
+    config.save_config(cfg)
+    version = _file_version(path)
+    if version is not None:
+        _config_cache[path] = (version, cfg)
 
 
 def get(key: str) -> str | None:
@@ -73,13 +129,19 @@ def get(key: str) -> str | None:
         return None
     if _check_keyring():
         return _read_blob().get(key)
-    from src.config import load_config
-    return load_config().get(key)
+    return _load_config().get(key)
 
 
 def get_all() -> dict[str, str | None]:
-    """Load all credential values."""
-    return {k: get(k) for k in ALL_KEYS}
+    """Load all credential values.
+
+    Reads the session cache, keyring blob or config.json once for the whole
+    dict rather than once per key.
+    """
+    if _session_cache is not None:
+        return {k: _session_cache.get(k) for k in ALL_KEYS}
+    source = _read_blob() if _check_keyring() else _load_config()
+    return {k: None if k in SESSION_ONLY_KEYS else source.get(k) for k in ALL_KEYS}
 
 
 def set(key: str, value: str) -> None:
@@ -99,16 +161,32 @@ def set(key: str, value: str) -> None:
             blob[key] = value
         _write_blob(blob)
     else:
-        from src.config import load_config, save_config
-        cfg = load_config()
+        cfg = dict(_load_config())
         cfg[key] = value
-        save_config(cfg)
+        _save_config(cfg)
 
 
 def set_many(credentials: dict[str, str]) -> None:
-    """Store multiple credential values."""
-    for k, v in credentials.items():
-        set(k, v)
+    """Store multiple credential values with a single keyring (or config.json) write."""
+    for key in credentials:
+        if key not in ALL_KEYS:
+            raise ValueError(f"Unknown credential key: {key}")
+    if _session_cache is not None:
+        _session_cache.update(credentials)
+    persistent = {k: v for k, v in credentials.items() if k not in SESSION_ONLY_KEYS}
+    if not persistent:
+        return
+    if _check_keyring():
+        if _session_cache is not None:
+            blob = {k: _session_cache[k] for k in CREDENTIAL_KEYS if k in _session_cache}
+        else:
+            blob = _read_blob()
+            blob.update(persistent)
+        _write_blob(blob)
+    else:
+        cfg = dict(_load_config())
+        cfg.update(persistent)
+        _save_config(cfg)
 
 
 def delete(key: str) -> None:
@@ -127,11 +205,9 @@ def delete(key: str) -> None:
             blob.pop(key, None)
         _write_blob(blob)
     else:
-        from src.config import load_config, save_config
-        cfg = load_config()
+        cfg = _load_config()
         if key in cfg:
-            del cfg[key]
-            save_config(cfg)
+            _save_config({k: v for k, v in cfg.items() if k != key})
 
 
 def delete_all() -> None:
@@ -139,16 +215,13 @@ def delete_all() -> None:
     if _session_cache is not None:
         _session_cache.clear()
     if _check_keyring():
-        import keyring as kr
         try:
-            kr.delete_password(SERVICE_NAME, CREDENTIAL_ACCOUNT)
+            _keyring().delete_password(SERVICE_NAME, CREDENTIAL_ACCOUNT)
         except Exception:
             pass
     else:
-        from src.config import load_config, save_config
-        cfg = load_config()
-        remaining = {k: v for k, v in cfg.items() if k not in CREDENTIAL_KEYS}
-        save_config(remaining)
+        cfg = _load_config()
+        _save_config({k: v for k, v in cfg.items() if k not in CREDENTIAL_KEYS})
 
 
 def load_session() -> None:
@@ -164,8 +237,7 @@ def load_session() -> None:
     if _check_keyring():
         _session_cache.update(_read_blob())
     else:
-        from src.config import load_config
-        cfg = load_config()
+        cfg = _load_config()
         for key in CREDENTIAL_KEYS:
             if key in cfg:
                 _session_cache[key] = cfg[key]
@@ -173,10 +245,11 @@ def load_session() -> None:
 
 def clear_session() -> None:
     """Wipe the in-memory session cache."""
-    global _session_cache
+    global _session_cache, _blob_cache
     if _session_cache is not None:
         _session_cache.clear()
     _session_cache = None
+    _blob_cache = None
 
 
 def _migrate_single_config(cfg_path: str) -> bool:
@@ -37,7 +37,7 @@ class _QueueWriter(io.TextIOBase):
 
 def _ensure_credentials_gui(config: dict, root: tk.Tk) -> dict:
     """Prompt for DrChrono credentials via GUI dialogs if missing."""
-    from src.credential_store import get as cred_get, set as cred_set
+    from src.credential_store import get as cred_get, set_many as cred_set_many
     client_id = cred_get("client_id") or config.get("client_id")
     client_secret = cred_get("client_secret") or config.get("client_secret")
     if client_id and client_secret:
@@ -64,8 +64,7 @@ def _ensure_credentials_gui(config: dict, root: tk.Tk) -> dict:
 
     client_id = client_id.strip()
     client_secret = client_secret.strip()
-    cred_set("client_id", client_id)
-    cred_set("client_secret", client_secret)
+    cred_set_many({"client_id": client_id, "client_secret": client_secret})
     config["client_id"] = client_id
     config["client_secret"] = client_secret
     return config
@@ -271,7 +270,7 @@ class App:
 
     def _change_credentials(self):
         """Prompt for new client credentials and store them."""
-        from src.credential_store import set as cred_set
+        from src.credential_store import set_many as cred_set_many
 
         client_id = simpledialog.askstring(
             "Change Credentials", "New Client ID:", parent=self.root,
@@ -284,8 +283,7 @@ class App:
         if not client_secret:
             return
 
-        cred_set("client_id", client_id.strip())
-        cred_set("client_secret", client_secret.strip())
+        cred_set_many({"client_id": client_id.strip(), "client_secret": client_secret.strip()})
         messagebox.showinfo(
             "Credentials Updated",
             "Client credentials have been updated. You will need to re-authorize on the next upload.",
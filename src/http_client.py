@@ -0,0 +1,30 @@
+"""Shared HTTP session for DrChrono calls (keep-alive connection pooling)."""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Enough pooled connections for every upload worker plus the auth flow
+POOL_SIZE = 32
+
+
+def _build_session() -> requests.Session:
+    """Create a session that reuses TCP+TLS connections across requests.
+
+    Transient gateway errors on idempotent requests are retried at the
+    transport level. 429s are deliberately left out — api._request_with_retry
+    owns rate-limit handling so it can honour Retry-After and report it.
+    """
+    s = requests.Session()
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+    s.mount("https://", adapter)
+    return s
+
+
+session = _build_session()
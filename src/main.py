@@ -4,6 +4,7 @@
 import argparse
 import sys
 
+from src.api import clear_documents_cache
 from src.auth import ensure_auth
 from src.config import ensure_credentials, load_config, load_metatags
 from src.parser import DEFAULT_PATTERN, compile_pattern
@@ -80,11 +81,12 @@ def main():
         help="Filename pattern using placeholders (default: %(default)s)",
     )
     upload_parser.add_argument(
-        "--num-workers",
+        "--num-workers", "--max-workers",
+        dest="num_workers",
         type=int,
         default=1,
         metavar="N",
-        help="Number of parallel upload workers (default: 1)",
+        help="Number of parallel upload workers, capped at 8 (default: 1)",
     )
 
     # --- update subcommand ---
@@ -94,6 +96,12 @@ def main():
     # --- uninstall subcommand ---
     subparsers.add_parser("uninstall", help="Remove chrono-uploader from this machine")
 
+    # --- clear-cache subcommand ---
+    subparsers.add_parser(
+        "clear-cache",
+        help="Delete the saved document dates/descriptions/tags (unencrypted, kept 7 days) used for duplicate checks",
+    )
+
     # --- gui subcommand ---
     subparsers.add_parser("gui", help="Launch graphical interface")
 
@@ -119,6 +127,9 @@ def main():
         _run_update(args)
     elif args.command == "uninstall":
         uninstall()
+    elif args.command == "clear-cache":
+        clear_documents_cache()
+        print("Document cache cleared.")
     elif args.command == "gui":
         from src.gui import launch
         launch()
@@ -1,25 +1,80 @@
 """Filename pattern compilation and parsing."""
 
+import collections
 import datetime
+import functools
 import re
-from pathlib import Path
-from typing import Optional
+import weakref
+from typing import NamedTuple, Optional
 
 from src.types import ParsedFilename
 
 DEFAULT_PATTERN = "{name}({dob})_{tag}_{date}_{description}"
 
 _PLACEHOLDER_REGEX: dict[str, str] = {
-    "name": r"(?P<last_name>[^,]+),\s*(?P<first_name>[^,]+?)(?:,\s*(?P<middle_initial>[^,]+?))?",
+    # possessive: the last name can never give back characters to the comma after it
+    "name": r"(?P<last_name>[^,]++),\s*(?P<first_name>[^,]+?)(?:,\s*(?P<middle_initial>[^,]+?))?",
     "last_name": r"(?P<last_name>.+?)",
     "first_name": r"(?P<first_name>.+?)",
     "middle_initial": r"(?P<middle_initial>[A-Z])",
-    "date": r"(?P<date>\d{6})",
-    "dob": r"(?P<dob>\d{6})",
+    "date": r"(?P<date_mm>\d{2})(?P<date_dd>\d{2})(?P<date_yy>\d{2})",
+    "dob": r"(?P<dob_mm>\d{2})(?P<dob_dd>\d{2})(?P<dob_yy>\d{2})",
 }
 
 _PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
 
+# Every pattern requires {date}, so a stem without six consecutive digits can't match
+_SIX_DIGITS_RE = re.compile(r"\d{6}", re.ASCII)
+
+# compiled pattern -> ((char, min count), ...) every matching stem must contain:
+# the template's required literal delimiters plus the comma implied by {name}.
+# Weakly keyed, so entries go away with patterns the compile cache evicts.
+_REQUIRED_CHARS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+class _SplitSpec(NamedTuple):
+    """How to parse a pattern's stems with str.split instead of its regex."""
+
+    delim: str
+    fields: tuple[str, ...]  # placeholders in template order, one per split part
+    has_optional: bool  # template has ({x}) groups, which only the regex handles
+    tags: frozenset  # metatag keys the compiled regex accepts
+
+
+# compiled pattern -> split spec, for patterns whose stems can skip the regex (weakly keyed too)
+_SPLIT_SPECS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+# Returned by _parse_split when only the regex can decide
+_NEEDS_REGEX = object()
+
+
+def _build_trie_regex(keys) -> str:
+    """Build a prefix-merged alternation matching exactly one of ``keys``.
+
+    ``["C", "CO", "HP"]`` becomes ``(?:C(?:O)?|HP)``: each character is tried
+    once per prefix instead of once per key, and the greedy optional tails
+    still prefer the longest key (CO over C).
+    """
+    trie: dict = {}
+    for key in keys:
+        node = trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # end-of-key marker
+
+    def _render(node: dict) -> str:
+        branches = [re.escape(ch) + _render(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        alternation = "|".join(branches)
+        if "" in node:
+            return f"(?:{alternation})?"
+        if len(branches) == 1:
+            return alternation
+        return f"(?:{alternation})"
+
+    return _render(trie)
+
 
 def compile_pattern(pattern: str, metatags: dict) -> re.Pattern:
     """Compile a filename pattern string into a regex.
@@ -27,20 +82,26 @@ def compile_pattern(pattern: str, metatags: dict) -> re.Pattern:
     Supported placeholders: {name}, {last_name}, {first_name},
     {middle_initial}, {tag}, {date}, {description}.
     Literal characters between placeholders are escaped.
+    Compiled patterns are cached per (pattern, metatags).
     """
-    tag_keys = sorted(metatags.keys(), key=len, reverse=True)
-    tag_regex = r"(?P<tag>" + "|".join(re.escape(k) for k in tag_keys) + ")"
+    return _compile_pattern_cached(pattern, frozenset(metatags.items()))
+
 
-    placeholders = {**_PLACEHOLDER_REGEX, "tag": tag_regex}
+@functools.lru_cache(maxsize=8)
+def _compile_pattern_cached(pattern: str, metatag_items: frozenset) -> re.Pattern:
+    tag_regex = r"(?P<tag>" + _build_trie_regex(k for k, _ in metatag_items) + ")"
 
     result_parts: list[str] = []
+    required_chars: collections.Counter = collections.Counter()
     pos = 0
     found_description = False
+    found_names: set[str] = set()
 
     for m in _PLACEHOLDER_RE.finditer(pattern):
         literal_before = pattern[pos:m.start()]
         name = m.group(1)
         after_end = m.end()
+        found_names.add(name)
 
         # Detect ({placeholder}) — parentheses make the group optional
         wrapped_in_parens = (
@@ -54,12 +115,15 @@ def compile_pattern(pattern: str, metatags: dict) -> re.Pattern:
             literal_without_paren = literal_before[:-1]
             if literal_without_paren:
                 result_parts.append(re.escape(literal_without_paren))
+                required_chars.update(literal_without_paren)
 
             if name == "description":
                 found_description = True
                 ph_regex = r"(?P<description>.+)"
-            elif name in placeholders:
-                ph_regex = placeholders[name]
+            elif name == "tag":
+                ph_regex = tag_regex
+            elif name in _PLACEHOLDER_REGEX:
+                ph_regex = _PLACEHOLDER_REGEX[name]
             else:
                 raise ValueError(f"Unknown placeholder: {{{name}}}")
 
@@ -68,12 +132,20 @@ def compile_pattern(pattern: str, metatags: dict) -> re.Pattern:
         else:
             if literal_before:
                 result_parts.append(re.escape(literal_before))
+                required_chars.update(literal_before)
+            if name == "name":
+                required_chars[","] += 1  # LAST,FIRST
 
             if name == "description":
                 found_description = True
-                result_parts.append(r"(?P<description>.+)")
-            elif name in placeholders:
-                result_parts.append(placeholders[name])
+                # A trailing description runs to the end of the stem, so it never needs
+                # to backtrack; a near-miss then fails in one pass instead of O(n) retries.
+                terminal = after_end == len(pattern)
+                result_parts.append(r"(?P<description>.++)" if terminal else r"(?P<description>.+)")
+            elif name == "tag":
+                result_parts.append(tag_regex)
+            elif name in _PLACEHOLDER_REGEX:
+                result_parts.append(_PLACEHOLDER_REGEX[name])
             else:
                 raise ValueError(f"Unknown placeholder: {{{name}}}")
 
@@ -81,68 +153,256 @@ def compile_pattern(pattern: str, metatags: dict) -> re.Pattern:
 
     if pos < len(pattern):
         result_parts.append(re.escape(pattern[pos:]))
+        required_chars.update(pattern[pos:])
 
     if not found_description:
         raise ValueError("Pattern must include {description} placeholder")
+    for required in ("tag", "date"):
+        if required not in found_names:
+            raise ValueError(f"Pattern must include {{{required}}} placeholder")
+
+    # Filenames are matched byte-for-byte against ASCII delimiters and digits
+    compiled = re.compile("^" + "".join(result_parts) + "$", re.ASCII)
+    _REQUIRED_CHARS[compiled] = tuple(sorted(required_chars.items()))
+    split_spec = _split_spec(pattern, frozenset(k for k, _ in metatag_items))
+    if split_spec is not None:
+        _SPLIT_SPECS[compiled] = split_spec
+    return compiled
+
+
+def _split_spec(pattern: str, tags: frozenset) -> Optional[_SplitSpec]:
+    """Return a split spec if every field in ``pattern`` is separated by one delimiter.
+
+    ``{last_name}-{first_name}-{tag}-{date}-{description}`` qualifies (delimiter
+    "-"); ``{name}({dob})_{tag}_{date}_{description}`` does too, with the
+    optional dob left to the regex. Templates with leading or trailing literals,
+    mixed or multi-character delimiters, or a tag key containing the delimiter
+    (the split would no longer be forced) don't.
+    """
+    fields: list[str] = []
+    delims: set[str] = set()
+    has_optional = False
+    pos = 0
+    for m in _PLACEHOLDER_RE.finditer(pattern):
+        literal_before = pattern[pos:m.start()]
+        wrapped = literal_before.endswith("(") and pattern[m.end():m.end() + 1] == ")"
+        if wrapped:
+            if literal_before != "(":  # the group must hang directly off a field
+                return None
+            has_optional = True
+            pos = m.end() + 1
+            continue
+        if fields:
+            delims.add(literal_before)
+        elif literal_before:
+            return None
+        fields.append(m.group(1))
+        pos = m.end()
+
+    if pos < len(pattern) or len(delims) != 1:
+        return None
+    (delim,) = delims
+    if len(delim) != 1 or delim in ",()\n" or any(delim in k for k in tags):
+        return None
+    return _SplitSpec(delim, tuple(fields), has_optional, tags)
+
+
+def _date_from_parts(mm: int, dd: int, yy: int) -> Optional[datetime.date]:
+    """Build a date from two-digit parts, pivoting years 00-50 to 20xx."""
+    year = 2000 + yy if yy <= 50 else 1900 + yy
+    try:
+        return datetime.date(year, mm, dd)
+    except ValueError:
+        return None
+
 
-    return re.compile("^" + "".join(result_parts) + "$")
+# Group names per date placeholder, built once rather than formatted on every parse
+_DATE_GROUP_KEYS = {prefix: (f"{prefix}_mm", f"{prefix}_dd", f"{prefix}_yy") for prefix in ("date", "dob")}
+
+
+def _date_from_groups(groups: dict, prefix: str) -> Optional[datetime.date]:
+    """Build a date from the ``<prefix>_mm/_dd/_yy`` groups of a match, if present."""
+    mm_key, dd_key, yy_key = _DATE_GROUP_KEYS[prefix]
+    mm = groups.get(mm_key)
+    if mm is None:
+        return None
+    return _date_from_parts(int(mm), int(groups[dd_key]), int(groups[yy_key]))
 
 
 def parse_date_mmddyy(date_str: str) -> Optional[datetime.date]:
     """Parse a MMDDYY date string into a date object."""
-    if len(date_str) != 6 or not date_str.isdigit():
+    if len(date_str) != 6:
         return None
-    mm, dd, yy = date_str[0:2], date_str[2:4], date_str[4:6]
-    year = int(yy)
-    year = 2000 + year if year <= 50 else 1900 + year
-    try:
-        return datetime.date(year, int(mm), int(dd))
-    except ValueError:
+    # ASCII digits only: str.isdigit() also accepts e.g. "²", which int() rejects
+    d = [ord(c) - 48 for c in date_str]
+    if not all(0 <= x <= 9 for x in d):
         return None
+    return _date_from_parts(d[0] * 10 + d[1], d[2] * 10 + d[3], d[4] * 10 + d[5])
 
 
 def parse_filename(filename: str, metatags: dict, pattern_re: re.Pattern) -> Optional[ParsedFilename]:
     """Parse a filename using the compiled pattern regex."""
-    stem = Path(filename).stem
-    m = pattern_re.match(stem)
-    if not m:
-        return None
+    return _parse(
+        filename, metatags, pattern_re.match, _REQUIRED_CHARS.get(pattern_re, ()), _SPLIT_SPECS.get(pattern_re)
+    )
 
-    groups = m.groupdict()
 
-    tag_code = groups.get("tag", "").upper()
-    if tag_code not in metatags:
+def parse_filenames(filenames: list[str], metatags: dict, pattern_re: re.Pattern) -> list[Optional[ParsedFilename]]:
+    """Parse a batch of filenames; same results as calling parse_filename on each.
+
+    Per-pattern setup (bound match method, delimiter pre-filter lookup) is
+    done once for the whole batch instead of once per file.
+    """
+    match = pattern_re.match
+    required = _REQUIRED_CHARS.get(pattern_re, ())
+    split_spec = _SPLIT_SPECS.get(pattern_re)
+    return [_parse(name, metatags, match, required, split_spec) for name in filenames]
+
+
+def _parse_split(stem: str, metatags: dict, spec: _SplitSpec):
+    """Parse ``stem`` by splitting on the template delimiter.
+
+    Gives the same result as the regex whenever the split is forced: exactly
+    one delimiter between each pair of fields, so no field can contain one.
+    Returns _NEEDS_REGEX for anything else (extra delimiters, a possible
+    optional group, a newline the regex's ``.`` would refuse).
+    """
+    if "\n" in stem or (spec.has_optional and "(" in stem):
+        return _NEEDS_REGEX
+    parts = stem.split(spec.delim)
+    if len(parts) != len(spec.fields):
+        return _NEEDS_REGEX if len(parts) > len(spec.fields) else None
+    if "" in parts:  # every placeholder matches at least one character
+        return None
+    fields = dict(zip(spec.fields, parts))
+
+    tag_code = fields["tag"]
+    if tag_code not in spec.tags:
+        return None
+    tag_full = metatags.get(tag_code)
+    if tag_full is None:
         return None
-    tag_full = metatags[tag_code]
 
-    doc_date = parse_date_mmddyy(groups.get("date", ""))
+    # \d{6} is ASCII-only, and str.isdigit() alone would accept e.g. "²"
+    date_str = fields["date"]
+    if len(date_str) != 6 or not (date_str.isascii() and date_str.isdigit()):
+        return None
+    doc_date = _date_from_parts(int(date_str[:2]), int(date_str[2:4]), int(date_str[4:]))
     if doc_date is None:
         return None
 
-    last_name = groups.get("last_name", "").strip()
-    first_name = groups.get("first_name", "").strip()
-    middle_initial = groups.get("middle_initial")
-    if middle_initial:
-        middle_initial = middle_initial.strip() or None
-    description = groups.get("description", "").strip()
+    name = fields.get("name")
+    if name is not None:
+        last_name, comma, rest = name.partition(",")
+        if not comma:
+            return None
+        first_name, comma, middle_initial = rest.partition(",")
+        # The regex needs a character after a second comma and allows no third
+        if (comma and not middle_initial) or "," in middle_initial:
+            return None
+    else:
+        last_name = fields.get("last_name", "")
+        first_name = fields.get("first_name", "")
+        middle_initial = fields.get("middle_initial")
+        if middle_initial is not None and not (len(middle_initial) == 1 and "A" <= middle_initial <= "Z"):
+            return None
+
+    dob_date = None
+    dob_str = fields.get("dob")
+    if dob_str is not None:
+        if len(dob_str) != 6 or not (dob_str.isascii() and dob_str.isdigit()):
+            return None
+        # An impossible dob is dropped, not rejected
+        dob_date = _date_from_parts(int(dob_str[:2]), int(dob_str[2:4]), int(dob_str[4:]))
+
+    return _build_result(
+        last_name, first_name, middle_initial, dob_date, tag_code, tag_full, doc_date, fields.get("description", "")
+    )
 
-    dob_raw = groups.get("dob")
-    dob_date = parse_date_mmddyy(dob_raw) if dob_raw else None
-    dob_iso = dob_date.isoformat() if dob_date else None
 
+def _build_result(
+    last_name: str,
+    first_name: str,
+    middle_initial: Optional[str],
+    dob_date: Optional[datetime.date],
+    tag_code: str,
+    tag_full: str,
+    doc_date: datetime.date,
+    description: str,
+) -> Optional[ParsedFilename]:
+    """Normalize matched fields into a ParsedFilename, or None if a name is blank."""
+    last_name = last_name.strip()
+    first_name = first_name.strip()
     if not last_name or not first_name:
         return None
-
-    if not description:
-        description = tag_full
+    if middle_initial:
+        middle_initial = middle_initial.strip() or None
+    else:
+        middle_initial = None
+    description = description.strip() or tag_full
 
     return ParsedFilename(
         last_name=last_name,
         first_name=first_name,
         middle_initial=middle_initial,
-        dob=dob_iso,
+        dob=dob_date.isoformat() if dob_date else None,
         tag_code=tag_code,
         tag_full=tag_full,
         date=doc_date.isoformat(),
         description=description,
     )
+
+
+def _parse(
+    filename: str,
+    metatags: dict,
+    match,
+    required: tuple[tuple[str, int], ...],
+    split_spec: Optional[_SplitSpec] = None,
+) -> Optional[ParsedFilename]:
+    # Leading-dot names (.DS_Store) and trailing dots keep the whole name as the stem
+    head, dot, ext = filename.rpartition(".")
+    stem = head if head and ext else filename
+
+    if split_spec is not None:
+        result = _parse_split(stem, metatags, split_spec)
+        if result is not _NEEDS_REGEX:
+            return result
+
+    # Reject obvious non-matches (.DS_Store, Thumbs.db, partial downloads) before the full regex:
+    # placeholders can add delimiters but never remove the template's own.
+    for ch, count in required:
+        if stem.count(ch) < count:
+            return None
+    if not _SIX_DIGITS_RE.search(stem):
+        return None
+
+    m = match(stem)
+    if not m:
+        return None
+
+    groups = m.groupdict()
+
+    # compile_pattern guarantees {tag} and {date}; the tag alternation only
+    # matches exact metatag keys, so no case folding is needed here. The date
+    # regex already restricts each part to two digits.
+    tag_code = groups["tag"]
+    tag_full = metatags.get(tag_code)
+    if tag_full is None:
+        return None
+
+    doc_date = _date_from_groups(groups, "date")
+    if doc_date is None:
+        return None
+
+    # Groups inside an unmatched ({x}) come back as None
+    return _build_result(
+        groups.get("last_name") or "",
+        groups.get("first_name") or "",
+        groups.get("middle_initial"),
+        _date_from_groups(groups, "dob"),
+        tag_code,
+        tag_full,
+        doc_date,
+        groups.get("description") or "",
+    )
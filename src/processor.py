@@ -1,33 +1,64 @@
 """Batch directory processing: parse, lookup, upload, report."""
 
+import errno
+import functools
+import io
+import itertools
+import os
 import random
 import re
 import shutil
 import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
 import requests
 
-from src.api import RateLimitError, find_patient, is_duplicate, upload_document
-from src.parser import parse_filename
+from src.api import (
+    RateLimitError,
+    find_patient,
+    get_patient_documents,
+    is_duplicate,
+    retry_log,
+    upload_document,
+)
+from src.auth import refresh_if_expiring
+from src.parser import parse_filenames
 from src.types import (
     FileError,
     FileErrorReason,
+    ParsedFilename,
     PatientLookupStatus,
     UploadStatus,
 )
 
+# Upper bound on parallel workers. Each worker already throttles itself with
+# _INTER_FILE_SLEEP; more than this would push past DrChrono's 10 req/s limit.
+MAX_WORKERS = 8
+
 # Max jitter in seconds between worker starts
 _WORKER_JITTER_MAX = 0.5
 
-# Sleep between consecutive API-touching files per worker (seconds).
-# DrChrono throttles at 290 requests per 10-minute window and 10 requests
-# per second.  A 2-second pause keeps us well under both limits.
+# Minimum gap between the starts of consecutive API-touching files per worker
+# (seconds). DrChrono throttles at 290 requests per 10-minute window and 10
+# requests per second.  A 2-second spacing keeps us well under both limits.
 _INTER_FILE_SLEEP = 2.0
 
+# End-of-run summary, filled in and printed in one write
+_SUMMARY_RULE = "=" * 50
+_SUMMARY_TEMPLATE = f"""
+{_SUMMARY_RULE}
+Uploaded:      {{uploaded}}
+Failed:        {{failed}}
+Skipped:       {{skipped}}
+Duplicates:    {{duplicates}}
+Rate-limited:  {{rate_limited}}
+Total:         {{total}}
+{_SUMMARY_RULE}"""
+
 
 class _FileResult:
     """Result of processing a single file."""
@@ -47,38 +78,54 @@ class _FileResult:
         self.document_id = document_id
 
 
-def _process_single_file(
+def _move_file(src: Path, dst: Path) -> None:
+    """Move an uploaded file into the destination directory.
+
+    A same-filesystem move is a single rename; only a move across devices
+    falls back to shutil.move's copy-and-delete. os.replace (rather than
+    os.rename) overwrites an existing destination on Windows too, as
+    shutil.move did.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        shutil.move(str(src), str(dst))
+
+
+def _process_file(
     config,
     file_path: Path,
-    metatags: dict,
-    pattern_re: re.Pattern,
+    parsed: Optional[ParsedFilename],
     dry_run: bool,
     dest_dir: Optional[Path],
     worker_id: int,
+    log,
 ) -> _FileResult:
-    """Process a single file: parse, lookup patient, check dupe, upload."""
+    """Process a single pre-parsed file: lookup patient, check dupe, upload."""
     filename = file_path.name
     tag = f"[W{worker_id}]"
 
-    parsed = parse_filename(filename, metatags, pattern_re)
     if parsed is None:
-        print(f"  {tag} SKIP  {filename} (could not parse filename)")
+        log(f"  {tag} SKIP  {filename} (could not parse filename)")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=FileErrorReason.PARSE_FAILED),
             category="skipped",
         )
 
-    print(f"  {tag} Processing: {filename}")
-    print(f"  {tag}   Patient: {parsed.last_name}, {parsed.first_name}"
-          f"{' ' + parsed.middle_initial if parsed.middle_initial else ''}")
-    print(f"  {tag}   Tag: {parsed.tag_code} ({parsed.tag_full})")
-    print(f"  {tag}   Date: {parsed.date}")
-    print(f"  {tag}   Description: {parsed.description}")
+    log(f"  {tag} Processing: {filename}")
+    log(f"  {tag}   Patient: {parsed.last_name}, {parsed.first_name}"
+        f"{' ' + parsed.middle_initial if parsed.middle_initial else ''}")
+    log(f"  {tag}   Tag: {parsed.tag_code} ({parsed.tag_full})")
+    log(f"  {tag}   Date: {parsed.date}")
+    log(f"  {tag}   Description: {parsed.description}")
     if parsed.dob:
-        print(f"  {tag}   DOB: {parsed.dob}")
+        log(f"  {tag}   DOB: {parsed.dob}")
 
     try:
+        refresh_if_expiring(config)
         lookup = find_patient(
             config,
             parsed.last_name,
@@ -87,10 +134,10 @@ def _process_single_file(
             dob=parsed.dob,
         )
     except RateLimitError as exc:
-        print(f"  {tag}   RATE LIMITED  {exc}")
+        log(f"  {tag}   RATE LIMITED  {exc}")
         if exc.is_app_limit:
-            print(f"  {tag}   *** You have hit the DrChrono application rate limit (500 requests/hour). ***")
-            print(f"  {tag}   *** Please wait until the top of the hour before running again. ***")
+            log(f"  {tag}   *** You have hit the DrChrono application rate limit (500 requests/hour). ***")
+            log(f"  {tag}   *** Please wait until the top of the hour before running again. ***")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=FileErrorReason.RATE_LIMITED, detail=str(exc)),
@@ -98,20 +145,20 @@ def _process_single_file(
         )
     except requests.RequestException as exc:
         detail = f"patient lookup failed: {exc}"
-        print(f"  {tag}   FAIL  {detail}")
+        log(f"  {tag}   FAIL  {detail}")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=FileErrorReason.UPLOAD_FAILED, detail=detail),
             category="failed",
         )
 
-    if lookup.status != PatientLookupStatus.FOUND:
-        if lookup.status == PatientLookupStatus.NOT_FOUND:
+    if lookup.status is not PatientLookupStatus.FOUND:
+        if lookup.status is PatientLookupStatus.NOT_FOUND:
             error_reason = FileErrorReason.PATIENT_NOT_FOUND
-            print(f"  {tag}   FAIL  patient not found")
+            log(f"  {tag}   FAIL  patient not found")
         else:
             error_reason = FileErrorReason.PATIENT_MULTIPLE_MATCHES
-            print(f"  {tag}   FAIL  patient multiple matches: {lookup.detail}")
+            log(f"  {tag}   FAIL  patient multiple matches: {lookup.detail}")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=error_reason, detail=lookup.detail),
@@ -121,10 +168,10 @@ def _process_single_file(
     try:
         dup = is_duplicate(config, lookup.patient_id, parsed.date, parsed.description, parsed.tag_full)
     except RateLimitError as exc:
-        print(f"  {tag}   RATE LIMITED  {exc}")
+        log(f"  {tag}   RATE LIMITED  {exc}")
         if exc.is_app_limit:
-            print(f"  {tag}   *** You have hit the DrChrono application rate limit (500 requests/hour). ***")
-            print(f"  {tag}   *** Please wait until the top of the hour before running again. ***")
+            log(f"  {tag}   *** You have hit the DrChrono application rate limit (500 requests/hour). ***")
+            log(f"  {tag}   *** Please wait until the top of the hour before running again. ***")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=FileErrorReason.RATE_LIMITED, detail=str(exc)),
@@ -132,14 +179,14 @@ def _process_single_file(
         )
     except requests.RequestException as exc:
         detail = f"duplicate check failed: {exc}"
-        print(f"  {tag}   FAIL  {detail}")
+        log(f"  {tag}   FAIL  {detail}")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=FileErrorReason.UPLOAD_FAILED, detail=detail),
             category="failed",
         )
     if dup:
-        print(f"  {tag}   DUP   duplicate document already exists")
+        log(f"  {tag}   DUP   duplicate document already exists")
         return _FileResult(
             filename=filename,
             error=FileError(
@@ -151,7 +198,7 @@ def _process_single_file(
         )
 
     if dry_run:
-        print(f"  {tag}   DRY   would upload to patient {lookup.patient_id}")
+        log(f"  {tag}   DRY   would upload to patient {lookup.patient_id}")
         return _FileResult(filename=filename, succeeded=True)
 
     try:
@@ -165,25 +212,25 @@ def _process_single_file(
             parsed.tag_full,
         )
     except RateLimitError as exc:
-        print(f"  {tag}   RATE LIMITED  {exc}")
+        log(f"  {tag}   RATE LIMITED  {exc}")
         if exc.is_app_limit:
-            print(f"  {tag}   *** You have hit the DrChrono application rate limit (500 requests/hour). ***")
-            print(f"  {tag}   *** Please wait until the top of the hour before running again. ***")
+            log(f"  {tag}   *** You have hit the DrChrono application rate limit (500 requests/hour). ***")
+            log(f"  {tag}   *** Please wait until the top of the hour before running again. ***")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=FileErrorReason.RATE_LIMITED, detail=str(exc)),
             category="failed",
         )
 
-    if result.status == UploadStatus.SUCCESS:
-        print(f"  {tag}   OK    Document ID: {result.document_id}")
+    if result.status is UploadStatus.SUCCESS:
+        log(f"  {tag}   OK    Document ID: {result.document_id}")
         if dest_dir:
             dest_path = dest_dir / filename
-            shutil.move(str(file_path), str(dest_path))
-            print(f"  {tag}   MOVED {dest_path}")
+            _move_file(file_path, dest_path)
+            log(f"  {tag}   MOVED {dest_path}")
         return _FileResult(filename=filename, succeeded=True, document_id=result.document_id)
     else:
-        print(f"  {tag}   FAIL  {result.detail}")
+        log(f"  {tag}   FAIL  {result.detail}")
         return _FileResult(
             filename=filename,
             error=FileError(filename=filename, reason=FileErrorReason.UPLOAD_FAILED, detail=result.detail),
@@ -191,12 +238,57 @@ def _process_single_file(
         )
 
 
+def _process_single_file(
+    config,
+    file_path: Path,
+    parsed: Optional[ParsedFilename],
+    dry_run: bool,
+    dest_dir: Optional[Path],
+    worker_id: int,
+) -> _FileResult:
+    """Process one file, writing its log lines to stdout in a single write.
+
+    Buffering per file keeps output from parallel workers from interleaving
+    and takes the stdout lock once per file instead of once per line.
+    """
+    buf = io.StringIO()
+    log = functools.partial(print, file=buf)
+    # Rate-limit notices from the API calls below join this file's block
+    token = retry_log.set(lambda message: log(f"  [W{worker_id}]   {message}"))
+    try:
+        return _process_file(config, file_path, parsed, dry_run, dest_dir, worker_id, log)
+    finally:
+        retry_log.reset(token)
+        sys.stdout.write(buf.getvalue())
+
+
+class _Pacer:
+    """Spaces the starts of API-touching calls at least ``interval`` seconds apart.
+
+    The gap runs start-to-start, so time spent waiting on the API counts
+    toward it instead of stacking on top. Safe to share between threads:
+    each caller reserves the next free slot under the lock, then sleeps
+    outside it.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._next_start: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = now if self._next_start is None else max(now, self._next_start)
+            self._next_start = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
 def _worker_task(
     worker_id: int,
     config,
-    file_paths: list[Path],
-    metatags: dict,
-    pattern_re: re.Pattern,
+    items: list[tuple[Path, Optional[ParsedFilename]]],
     dry_run: bool,
     dest_dir: Optional[Path],
 ) -> list[_FileResult]:
@@ -205,14 +297,97 @@ def _worker_task(
     time.sleep(jitter)
 
     results = []
-    for i, file_path in enumerate(file_paths):
-        if i > 0 and not dry_run:
-            time.sleep(_INTER_FILE_SLEEP)
-        result = _process_single_file(config, file_path, metatags, pattern_re, dry_run, dest_dir, worker_id)
+    pacer = _Pacer(_INTER_FILE_SLEEP)
+    for file_path, parsed in items:
+        # Unparseable files never reach the API, so only the ones that do are spaced out
+        if parsed is not None and not dry_run:
+            pacer.wait()
+        result = _process_single_file(config, file_path, parsed, dry_run, dest_dir, worker_id)
         results.append(result)
     return results
 
 
+def _prefetch(config, fn, items: list, num_workers: int, pacer: Optional[_Pacer]) -> list:
+    """Run ``fn`` over ``items`` ahead of the main pass to warm the API caches.
+
+    Errors are swallowed here — each file repeats its (cached or failed)
+    call in the main pass and reports the error there. Stops early once the
+    API rate-limits us so we don't burn the remaining budget. Like the
+    per-file path, each call first refreshes the token if it is about to
+    expire, and calls are spaced by ``pacer`` when given. Returns the
+    results of the calls that succeeded.
+    """
+    rate_limited = threading.Event()
+
+    def _call(item):
+        if rate_limited.is_set():
+            return None
+        if pacer is not None:
+            pacer.wait()
+            if rate_limited.is_set():
+                return None
+        try:
+            refresh_if_expiring(config)
+            return fn(item)
+        except RateLimitError:
+            rate_limited.set()
+        except requests.RequestException:
+            pass
+        return None
+
+    if num_workers == 1:
+        results = [_call(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_call, items))
+    return [r for r in results if r is not None]
+
+
+def _prefetch_patients(
+    config,
+    parsed_files: list[Optional[ParsedFilename]],
+    num_workers: int,
+    pacer: Optional[_Pacer],
+) -> dict[int, int]:
+    """Look up each unique patient in the batch once; map found IDs to their file counts."""
+    unique: dict[tuple[str, str, str, str], ParsedFilename] = {}
+    file_counts: dict[tuple[str, str, str, str], int] = {}
+    for p in parsed_files:
+        if p is None:
+            continue
+        key = (p.last_name.lower(), p.first_name.lower(), (p.middle_initial or "").lower(), p.dob or "")
+        unique.setdefault(key, p)
+        file_counts[key] = file_counts.get(key, 0) + 1
+    if not unique:
+        return {}
+
+    print(f"Looking up {len(unique)} unique patient(s)...\n")
+    lookups = _prefetch(
+        config,
+        lambda item: (find_patient(config, item[1].last_name, item[1].first_name,
+                                   item[1].middle_initial, dob=item[1].dob), file_counts[item[0]]),
+        list(unique.items()),
+        num_workers,
+        pacer,
+    )
+    found: dict[int, int] = {}
+    for lookup, count in lookups:
+        if lookup.status is PatientLookupStatus.FOUND:
+            found[lookup.patient_id] = found.get(lookup.patient_id, 0) + count
+    return found
+
+
+def _prefetch_documents(config, patient_files: dict[int, int], num_workers: int, pacer: Optional[_Pacer]) -> None:
+    """Fetch existing documents for found patients before duplicate checks run.
+
+    Only patients with several files in the batch are worth a full listing;
+    a lone file is checked with one filtered query in is_duplicate instead.
+    """
+    patient_ids = sorted(pid for pid, count in patient_files.items() if count > 1)
+    if patient_ids:
+        _prefetch(config, lambda pid: get_patient_documents(config, pid), patient_ids, num_workers, pacer)
+
+
 def process_directory(config, directory, metatags, pattern_re: re.Pattern, dry_run=False, dest_dir=None, num_workers=1):
     """Read all files from a directory, parse filenames, and upload to DrChrono."""
     directory = Path(directory)
@@ -228,18 +403,33 @@ def process_directory(config, directory, metatags, pattern_re: re.Pattern, dry_r
     if dry_run:
         print("[DRY RUN] No files will be uploaded or moved.\n")
 
-    files = sorted([f for f in directory.iterdir() if f.is_file()])
+    # scandir's DirEntry.is_file() uses the type from readdir, avoiding a stat() per entry
+    with os.scandir(directory) as entries:
+        names = sorted(e.name for e in entries if e.is_file())
+    files = [directory / name for name in names]
     if not files:
         print(f"No files found in '{directory}'.")
         return
 
+    # Never run more workers than there are files or than the API can absorb
+    num_workers = max(1, min(num_workers, len(files), MAX_WORKERS))
+
     print(f"Found {len(files)} file(s) in '{directory}'.")
     print(f"Using {num_workers} worker(s).\n")
 
+    # Parse everything up front so patient lookups can be shared across files
+    parsed_files = parse_filenames(names, metatags, pattern_re)
+    # Both pre-passes share one pacer across their threads, at the same overall
+    # rate as num_workers workers each keeping _INTER_FILE_SLEEP apart
+    prefetch_pacer = None if dry_run else _Pacer(_INTER_FILE_SLEEP / num_workers)
+    patient_files = _prefetch_patients(config, parsed_files, num_workers, prefetch_pacer)
+    _prefetch_documents(config, patient_files, num_workers, prefetch_pacer)
+    items = list(zip(files, parsed_files))
+
     # Distribute files round-robin across workers
-    chunks: list[list[Path]] = [[] for _ in range(num_workers)]
-    for i, f in enumerate(files):
-        chunks[i % num_workers].append(f)
+    chunks: list[list[tuple[Path, Optional[ParsedFilename]]]] = [[] for _ in range(num_workers)]
+    for i, item in enumerate(items):
+        chunks[i % num_workers].append(item)
 
     succeeded = 0
     failed_files: list[FileError] = []
@@ -249,19 +439,23 @@ def process_directory(config, directory, metatags, pattern_re: re.Pattern, dry_r
 
     if num_workers == 1:
         # Single worker — run directly, no threading overhead
-        all_results = _worker_task(1, config, files, metatags, pattern_re, dry_run, dest_path)
+        all_results = _worker_task(1, config, items, dry_run, dest_path)
     else:
-        all_results = []
         with ThreadPoolExecutor(max_workers=num_workers) as executor:
-            futures = {
+            futures = [
                 executor.submit(
-                    _worker_task, worker_id + 1, config, chunk, metatags, pattern_re, dry_run, dest_path
-                ): worker_id
+                    _worker_task, worker_id + 1, config, chunk, dry_run, dest_path
+                )
                 for worker_id, chunk in enumerate(chunks)
-                if chunk  # skip empty chunks
-            }
-            for future in as_completed(futures):
-                all_results.extend(future.result())
+            ]
+            chunk_results = [future.result() for future in futures]
+        # Undo the round-robin split so the report lists files in directory order
+        all_results = [
+            r
+            for round_results in itertools.zip_longest(*chunk_results)
+            for r in round_results
+            if r is not None
+        ]
 
     for r in all_results:
         if r.succeeded:
@@ -299,15 +493,14 @@ def process_directory(config, directory, metatags, pattern_re: re.Pattern, dry_r
             "the remaining files. ***"
         )
 
-    # --- Summary ---
-    print(f"\n{'=' * 50}")
-    print(f"Uploaded:      {succeeded}")
-    print(f"Failed:        {len(failed_files)}")
-    print(f"Skipped:       {len(skipped_files)}")
-    print(f"Duplicates:    {len(duplicate_files)}")
-    print(f"Rate-limited:  {len(rate_limited_files)}")
-    print(f"Total:         {len(files)}")
-    print(f"{'=' * 50}")
+    print(_SUMMARY_TEMPLATE.format(
+        uploaded=succeeded,
+        failed=len(failed_files),
+        skipped=len(skipped_files),
+        duplicates=len(duplicate_files),
+        rate_limited=len(rate_limited_files),
+        total=len(files),
+    ))
 
     if dry_run:
         print("\n[DRY RUN] No documents were uploaded or moved. Disable dry run to upload.")
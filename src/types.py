@@ -1,9 +1,8 @@
-"""Enums and Pydantic models used across the application."""
+"""Enums and record types used across the application."""
 
+from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
-
-from pydantic import BaseModel
+from typing import NamedTuple, Optional
 
 
 # ---------------------------------------------------------------------------
@@ -34,31 +33,41 @@ class FileErrorReason(str, Enum):
 # Models
 # ---------------------------------------------------------------------------
 
-class ParsedFilename(BaseModel):
+# Plain slotted records: these are built once per file from trusted internal
+# data, so validation would only add construction cost.
+
+class ParsedFilename(NamedTuple):
+    # A NamedTuple builds ~2x faster than a frozen dataclass, and one is created
+    # for every file scanned. Construct by keyword, like the kw_only records
+    # below: defaulted fields must come last, so the positional order here
+    # doesn't follow the filename's name-first order.
     last_name: str
     first_name: str
-    middle_initial: Optional[str] = None
-    dob: Optional[str] = None
     tag_code: str
     tag_full: str
     date: str
     description: str
+    middle_initial: Optional[str] = None
+    dob: Optional[str] = None
 
 
-class PatientLookupResult(BaseModel):
+@dataclass(slots=True, frozen=True, kw_only=True)
+class PatientLookupResult:
     status: PatientLookupStatus
     patient_id: Optional[int] = None
     doctor_id: Optional[int] = None
     detail: Optional[str] = None
 
 
-class UploadResult(BaseModel):
+@dataclass(slots=True, frozen=True, kw_only=True)
+class UploadResult:
     status: UploadStatus
     document_id: Optional[int] = None
     detail: Optional[str] = None
 
 
-class FileError(BaseModel):
+@dataclass(slots=True, frozen=True, kw_only=True)
+class FileError:
     filename: str
     reason: FileErrorReason
     detail: Optional[str] = None
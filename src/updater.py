@@ -1,5 +1,6 @@
 """Self-update: download and replace the running binary with the latest release."""
 
+import hashlib
 import os
 import platform
 import shutil
@@ -15,12 +16,27 @@ from src.version import __version__
 REPO = "narora21/chrono-patient-uploader"
 RELEASES_URL = f"https://api.github.com/repos/{REPO}/releases"
 
+# Plain-text version stamp bundled next to the binary in release archives
+VERSION_FILE = "version.txt"
+
 # ANSI escape codes
 _BOLD = "\033[1m"
 _YELLOW = "\033[33m"
 _RESET = "\033[0m"
 
 
+class _HashingWriter:
+    """File wrapper that feeds every written chunk into a hash as it passes through."""
+
+    def __init__(self, f, h):
+        self.f = f
+        self.h = h
+
+    def write(self, b):
+        self.h.update(b)
+        return self.f.write(b)
+
+
 def _parse_version(tag: str) -> tuple[int, ...]:
     """Parse a version tag like 'v1.2.3' into (1, 2, 3)."""
     return tuple(int(x) for x in tag.lstrip("v").split("."))
@@ -101,6 +117,36 @@ def cleanup_old_binary():
         pass
 
 
+def _read_version_file(path: str) -> str | None:
+    """Read the version stamp bundled in a release archive, or None if unreadable."""
+    try:
+        with open(path, "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _verify_update(binary_path: str, release_tag: str, version_file: str | None):
+    """Confirm the installed binary matches the release.
+
+    Prefers the version stamp shipped in the archive so we don't cold-start the
+    new binary; older releases without the stamp fall back to ``--version``.
+    """
+    bundled = _read_version_file(version_file) if version_file else None
+    if bundled is not None:
+        if bundled.lstrip("v") == release_tag.lstrip("v"):
+            print(f"Updated successfully to chrono-uploader {bundled}.")
+        else:
+            print(f"Warning: Update installed but archive reports version {bundled} (expected {release_tag}).")
+        return
+
+    result = subprocess.run([binary_path, "--version"], capture_output=True, text=True)
+    if result.returncode == 0:
+        print(f"Updated successfully to {result.stdout.strip()}.")
+    else:
+        print("Warning: Update installed but verification failed.")
+
+
 def _fetch_latest_release():
     """Fetch all releases and return the one with the highest semver tag."""
     resp = requests.get(RELEASES_URL, timeout=10)
@@ -177,9 +223,12 @@ def self_update(target_version=None):
 
     archive_name = _get_platform_archive()
     download_url = None
+    expected_digest = None
     for asset in release.get("assets", []):
         if asset["name"] == archive_name:
             download_url = asset["browser_download_url"]
+            # GitHub publishes "sha256:<hex>" for assets; older releases may omit it
+            expected_digest = asset.get("digest")
             break
 
     if not download_url:
@@ -195,9 +244,15 @@ def self_update(target_version=None):
         archive_path = os.path.join(tmpdir, archive_name)
         with requests.get(download_url, stream=True, timeout=60) as r:
             r.raise_for_status()
+            r.raw.decode_content = True
             with open(archive_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+                hw = _HashingWriter(f, hashlib.sha256())
+                shutil.copyfileobj(r.raw, hw, length=1 << 20)
+
+        if expected_digest and expected_digest.startswith("sha256:"):
+            if hw.h.hexdigest() != expected_digest.split(":", 1)[1].lower():
+                print("Error: Downloaded archive failed SHA-256 verification.")
+                sys.exit(1)
 
         extract_dir = os.path.join(tmpdir, "extracted")
         os.makedirs(extract_dir)
@@ -215,22 +270,22 @@ def self_update(target_version=None):
         system = platform.system()
         exe_name = "chrono-uploader.exe" if system == "Windows" else "chrono-uploader"
 
-        new_binary = None
+        # Single walk over the extracted tree: the binary, bundled files, and version stamp
+        wanted = {exe_name, "metatag.json", "README.md", VERSION_FILE}
+        found: dict[str, str] = {}
         for root, dirs, files in os.walk(extract_dir):
-            if exe_name in files:
-                new_binary = os.path.join(root, exe_name)
-                break
+            for fname in wanted.intersection(files):
+                found.setdefault(fname, os.path.join(root, fname))
 
+        new_binary = found.get(exe_name)
         if not new_binary:
             print("Error: Could not find executable in downloaded archive.")
             sys.exit(1)
 
         # Copy bundled files (these aren't locked, safe to overwrite)
         for fname in ("metatag.json", "README.md"):
-            for root, dirs, files in os.walk(extract_dir):
-                if fname in files:
-                    shutil.copy2(os.path.join(root, fname), os.path.join(install_dir, fname))
-                    break
+            if fname in found:
+                shutil.copy2(found[fname], os.path.join(install_dir, fname))
 
         # Replace the current binary
         print(f"Updating {binary_path}...")
@@ -248,11 +303,7 @@ def self_update(target_version=None):
                 subprocess.run(["codesign", "--force", "--sign", "-", binary_path],
                                capture_output=True)
             print("Verifying update...")
-            result = subprocess.run([binary_path, "--version"], capture_output=True, text=True)
-            if result.returncode == 0:
-                print(f"Updated successfully to {result.stdout.strip()}.")
-            else:
-                print("Warning: Update installed but verification failed.")
+            _verify_update(binary_path, release_tag, found.get(VERSION_FILE))
 
     finally:
         shutil.rmtree(tmpdir, ignore_errors=True)
@@ -1,6 +1,7 @@
 """Shared test fixtures."""
 
 import pytest
+import requests
 
 
 @pytest.fixture(autouse=True)
@@ -10,8 +11,103 @@ def _disable_keyring_in_tests(monkeypatch):
     With _keyring_available = False, credential_store.get() falls back to
     config.json (which doesn't exist in test), returning None.  This lets
     existing FAKE_CONFIG dicts continue to work via the ``or config.get(...)``
-    fallback in api_headers / auth functions.
+    fallback in the auth functions.
     """
     from src import credential_store
     monkeypatch.setattr(credential_store, "_keyring_available", False)
+    monkeypatch.setattr(credential_store, "_keyring_mod", None)
+    monkeypatch.setattr(credential_store, "_blob_cache", None)
     monkeypatch.setattr(credential_store, "_session_cache", None)
+    monkeypatch.setattr(credential_store, "_config_cache", {})
+
+
+@pytest.fixture(autouse=True)
+def _block_network(monkeypatch):
+    """Fail fast on any DrChrono call a test didn't mock explicitly.
+
+    Tests that exercise the HTTP layer request the ``mock_request`` fixture,
+    which takes precedence over this one.
+    """
+    from src import http_client
+
+    def _no_network(method, url, **kwargs):
+        raise requests.ConnectionError(f"network access disabled in tests: {method} {url}")
+
+    monkeypatch.setattr(http_client.session, "request", _no_network)
+    # Tokens stored by a test must not leak into the next one's session headers
+    monkeypatch.setattr(http_client.session, "headers", http_client.session.headers.copy())
+
+
+@pytest.fixture(autouse=True)
+def _clear_api_caches():
+    """Start every test with empty in-memory API caches."""
+    from src import api
+    api._patient_cache.clear()
+    api._documents_cache.clear()
+    api._document_filter_supported = True
+
+
+class _Recorder:
+    """Records calls to session.request and answers them; cheaper to import than unittest.mock.
+
+    ``side_effect`` is a list of responses to replay in order, or a callable
+    given the request's arguments; otherwise every call gets ``return_value``.
+    """
+
+    __slots__ = ("calls", "side_effect", "return_value")
+
+    def __init__(self):
+        self.calls = []  # (args, kwargs) per call
+        self.side_effect = None
+        self.return_value = None
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        effect = self.side_effect
+        if effect is None:
+            return self.return_value
+        if callable(effect):
+            return effect(*args, **kwargs)
+        if isinstance(effect, list):
+            effect = self.side_effect = iter(effect)
+        return next(effect)
+
+    @property
+    def call_count(self):
+        return len(self.calls)
+
+
+@pytest.fixture
+def mock_request(monkeypatch):
+    """Recorder for the shared session's request method; tests set return_value/side_effect."""
+    from src import http_client
+    recorder = _Recorder()
+    monkeypatch.setattr(http_client.session, "request", recorder)
+    return recorder
+
+
+@pytest.fixture(scope="session")
+def fake_pdf(tmp_path_factory):
+    """One on-disk document shared by the upload tests; upload_document only reads it."""
+    path = tmp_path_factory.mktemp("upload") / "test.pdf"
+    path.write_bytes(b"fake pdf")
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def _documents_cache_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("documents_cache")
+
+
+@pytest.fixture(autouse=True)
+def _isolate_documents_cache(monkeypatch, _documents_cache_dir):
+    """Keep the persistent document-list cache out of the real data directory.
+
+    The directory is shared by the whole session; the file is removed after
+    each test so nothing carries over.
+    """
+    from src import config
+    path = _documents_cache_dir / "documents_cache.sqlite3"
+    monkeypatch.setattr(config, "DOCUMENTS_CACHE_FILE", str(path))
+    yield
+    path.unlink(missing_ok=True)
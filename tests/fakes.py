@@ -0,0 +1,32 @@
+"""Lightweight stand-ins shared by the HTTP-layer tests."""
+
+import json
+
+
+class FakeResponse:
+    """Minimal stand-in for requests.Response; much cheaper to build than a MagicMock."""
+
+    __slots__ = ("_json", "status_code", "headers", "_text")
+
+    def __init__(self, json_data, status_code, headers):
+        self._json = json_data
+        self.status_code = status_code
+        self.headers = headers
+        self._text = None
+
+    @property
+    def text(self):
+        # Built on first access; most tests never read the body text
+        if self._text is None:
+            self._text = json.dumps(self._json)
+        return self._text
+
+    def json(self):
+        return self._json
+
+    def raise_for_status(self):
+        return None
+
+
+def mock_response(json_data=None, status_code=200, headers=None):
+    return FakeResponse({} if json_data is None else json_data, status_code, headers or {})
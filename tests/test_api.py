@@ -1,32 +1,22 @@
 """Tests for DrChrono API operations: patient lookup, duplicate detection, upload."""
 
-import json
-from unittest.mock import MagicMock, patch
+import sqlite3
+import time
 
 import pytest
 
-from src import api
+from src import api, config
 from src.api import find_patient, is_duplicate, upload_document
 from src.types import PatientLookupStatus, UploadStatus
+from tests.fakes import mock_response
 
 FAKE_CONFIG = {"access_token": "test-token"}
 
-
-def _mock_response(json_data, status_code=200):
-    resp = MagicMock()
-    resp.json.return_value = json_data
-    resp.status_code = status_code
-    resp.text = json.dumps(json_data)
-    resp.raise_for_status.return_value = None
-    return resp
-
-
-@pytest.fixture(autouse=True)
-def _clear_caches():
-    """Clear module-level caches before each test."""
-    api._patient_cache.clear()
-    api._documents_cache.clear()
-    yield
+_EMPTY_RESULTS = mock_response({"results": []})
+_LAST_EMPTY_PAGE = mock_response({"results": [], "next": None})
+_JANE_DOE = mock_response({"results": [
+    {"id": 42, "doctor": 7, "first_name": "JANE", "last_name": "DOE"},
+]})
 
 
 # -----------------------------------------------------------------------
@@ -34,26 +24,21 @@ def _clear_caches():
 # -----------------------------------------------------------------------
 
 class TestFindPatient:
-    @patch("src.api.requests.request")
     def test_not_found(self, mock_request):
-        mock_request.return_value = _mock_response({"results": []})
+        mock_request.return_value = _EMPTY_RESULTS
         result = find_patient(FAKE_CONFIG, "DOE", "JANE")
         assert result.status == PatientLookupStatus.NOT_FOUND
         assert result.patient_id is None
 
-    @patch("src.api.requests.request")
     def test_single_match(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
-            {"id": 42, "doctor": 7, "first_name": "JANE", "last_name": "DOE"},
-        ]})
+        mock_request.return_value = _JANE_DOE
         result = find_patient(FAKE_CONFIG, "DOE", "JANE")
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 42
         assert result.doctor_id == 7
 
-    @patch("src.api.requests.request")
     def test_multiple_matches(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "last_name": "DOE", "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "last_name": "DOE", "date_of_birth": "1985-05-05"},
         ]})
@@ -63,9 +48,8 @@ class TestFindPatient:
         assert "1990-01-01" in result.detail
         assert "1985-05-05" in result.detail
 
-    @patch("src.api.requests.request")
     def test_middle_initial_filters(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "middle_name": "Marie", "last_name": "DOE"},
             {"id": 2, "first_name": "JANE", "middle_name": "Ann", "last_name": "DOE"},
         ]})
@@ -73,19 +57,17 @@ class TestFindPatient:
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 1
 
-    @patch("src.api.requests.request")
     def test_middle_initial_no_match_keeps_all(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "middle_name": "Ann", "last_name": "DOE", "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "middle_name": "Beth", "last_name": "DOE", "date_of_birth": "1985-05-05"},
         ]})
         result = find_patient(FAKE_CONFIG, "DOE", "JANE", middle_initial="Z")
         assert result.status == PatientLookupStatus.MULTIPLE_MATCHES
 
-    @patch("src.api.requests.request")
     def test_exact_name_narrows_multiple(self, mock_request):
         """SMITH search returns SMITH and SMITHSON — exact match picks SMITH."""
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JOHN", "last_name": "SMITH", "doctor": 5},
             {"id": 2, "first_name": "JOHN", "last_name": "SMITHSON", "doctor": 6},
         ]})
@@ -93,10 +75,9 @@ class TestFindPatient:
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 1
 
-    @patch("src.api.requests.request")
     def test_exact_first_name_narrows_multiple(self, mock_request):
         """JO search returns JO and JOHN — exact match picks JO."""
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JO", "last_name": "DOE", "doctor": 5},
             {"id": 2, "first_name": "JOHN", "last_name": "DOE", "doctor": 6},
         ]})
@@ -104,48 +85,41 @@ class TestFindPatient:
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 1
 
-    @patch("src.api.requests.request")
     def test_middle_initial_still_multiple(self, mock_request):
         """Middle initial filters but still leaves multiple matches."""
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "middle_name": "Marie", "last_name": "DOE", "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "middle_name": "May", "last_name": "DOE", "date_of_birth": "1985-05-05"},
         ]})
         result = find_patient(FAKE_CONFIG, "DOE", "JANE", middle_initial="M")
         assert result.status == PatientLookupStatus.MULTIPLE_MATCHES
 
-    @patch("src.api.requests.request")
     def test_cache_returns_same_result(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
-            {"id": 42, "doctor": 7, "first_name": "JANE", "last_name": "DOE"},
-        ]})
+        mock_request.return_value = _JANE_DOE
         result1 = find_patient(FAKE_CONFIG, "DOE", "JANE")
         result2 = find_patient(FAKE_CONFIG, "DOE", "JANE")
         assert result1 == result2
         assert mock_request.call_count == 1  # only one API call
 
-    @patch("src.api.requests.request")
     def test_cache_key_case_insensitive(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 42, "doctor": 7, "first_name": "Jane", "last_name": "Doe"},
         ]})
         find_patient(FAKE_CONFIG, "DOE", "JANE")
         find_patient(FAKE_CONFIG, "doe", "jane")
         assert mock_request.call_count == 1
 
-    @patch("src.api.requests.request")
     def test_data_key_fallback(self, mock_request):
         """API may return 'data' instead of 'results'."""
-        mock_request.return_value = _mock_response({"data": [
+        mock_request.return_value = mock_response({"data": [
             {"id": 10, "doctor": 3, "first_name": "JOHN", "last_name": "SMITH"},
         ]})
         result = find_patient(FAKE_CONFIG, "SMITH", "JOHN")
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 10
 
-    @patch("src.api.requests.request")
     def test_dob_narrows_multiple_to_one(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "last_name": "DOE", "doctor": 5, "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "last_name": "DOE", "doctor": 6, "date_of_birth": "1985-05-05"},
         ]})
@@ -153,29 +127,26 @@ class TestFindPatient:
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 1
 
-    @patch("src.api.requests.request")
     def test_dob_no_match_keeps_all(self, mock_request):
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "last_name": "DOE", "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "last_name": "DOE", "date_of_birth": "1985-05-05"},
         ]})
         result = find_patient(FAKE_CONFIG, "DOE", "JANE", dob="2000-12-25")
         assert result.status == PatientLookupStatus.MULTIPLE_MATCHES
 
-    @patch("src.api.requests.request")
     def test_dob_not_provided_unchanged(self, mock_request):
         """Without DOB, multiple matches remain multiple."""
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "last_name": "DOE", "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "last_name": "DOE", "date_of_birth": "1985-05-05"},
         ]})
         result = find_patient(FAKE_CONFIG, "DOE", "JANE")
         assert result.status == PatientLookupStatus.MULTIPLE_MATCHES
 
-    @patch("src.api.requests.request")
     def test_dob_with_middle_initial_combined(self, mock_request):
         """DOB + middle initial together narrow from 3 to 1."""
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "middle_name": "Marie", "last_name": "DOE", "doctor": 5, "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "middle_name": "Marie", "last_name": "DOE", "doctor": 6, "date_of_birth": "1985-05-05"},
             {"id": 3, "first_name": "JANE", "middle_name": "Ann", "last_name": "DOE", "doctor": 7, "date_of_birth": "1990-01-01"},
@@ -184,10 +155,9 @@ class TestFindPatient:
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 1
 
-    @patch("src.api.requests.request")
     def test_cache_key_includes_dob(self, mock_request):
         """Different DOBs should produce separate cache entries."""
-        mock_request.return_value = _mock_response({"results": [
+        mock_request.return_value = mock_response({"results": [
             {"id": 1, "first_name": "JANE", "last_name": "DOE", "doctor": 5, "date_of_birth": "1990-01-01"},
             {"id": 2, "first_name": "JANE", "last_name": "DOE", "doctor": 6, "date_of_birth": "1985-05-05"},
         ]})
@@ -202,75 +172,141 @@ class TestFindPatient:
 # is_duplicate
 # -----------------------------------------------------------------------
 
-class TestIsDuplicate:
-    def _setup_docs_cache(self, patient_id, docs):
-        api._documents_cache[patient_id] = docs
+_CXR_DOC = {"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'}
+_CBC_DOC = {"date": "2025-01-01", "description": "CBC", "metatags": '["laboratory"]'}
 
-    def test_exact_match(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is True
 
-    def test_different_date(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2025-01-01", "CXR", "radiology") is False
+def _cxr_with_tags(metatags):
+    return ({"date": "2026-02-03", "description": "CXR", "metatags": metatags},)
 
-    def test_different_description(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "MRI", "radiology") is False
 
-    def test_different_tag(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "laboratory") is False
-
-    def test_metatags_as_list(self):
-        """metatags may already be a parsed list, not a JSON string."""
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": ["radiology"]},
-        ])
+class TestIsDuplicate:
+    @pytest.mark.parametrize("docs, date, description, tag, expected", [
+        pytest.param((_CXR_DOC,), "2026-02-03", "CXR", "radiology", True, id="exact_match"),
+        pytest.param((_CXR_DOC,), "2025-01-01", "CXR", "radiology", False, id="different_date"),
+        pytest.param((_CXR_DOC,), "2026-02-03", "MRI", "radiology", False, id="different_description"),
+        pytest.param((_CXR_DOC,), "2026-02-03", "CXR", "laboratory", False, id="different_tag"),
+        # metatags may already be a parsed list, not a JSON string
+        pytest.param(_cxr_with_tags(["radiology"]), "2026-02-03", "CXR", "radiology", True, id="metatags_as_list"),
+        pytest.param(_cxr_with_tags(None), "2026-02-03", "CXR", "radiology", False, id="metatags_null"),
+        pytest.param(_cxr_with_tags(""), "2026-02-03", "CXR", "radiology", False, id="metatags_empty_string"),
+        pytest.param(_cxr_with_tags("{bad json"), "2026-02-03", "CXR", "radiology", False, id="metatags_malformed_json"),
+        # Non-string entries are skipped rather than crashing the index
+        pytest.param(_cxr_with_tags('[["radiology"], {"a": 1}, 3, "radiology"]'), "2026-02-03", "CXR", "radiology",
+                     True, id="metatags_mixed_types"),
+        pytest.param(_cxr_with_tags([["radiology"]]), "2026-02-03", "CXR", "radiology", False,
+                     id="metatags_nested_list"),
+        pytest.param((), "2026-02-03", "CXR", "radiology", False, id="no_existing_documents"),
+        pytest.param((_CBC_DOC, _CXR_DOC), "2026-02-03", "CXR", "radiology", True, id="multiple_docs_one_matches"),
+        pytest.param(_cxr_with_tags('["laboratory", "radiology"]'), "2026-02-03", "CXR", "radiology", True,
+                     id="multiple_tags_in_metatags"),
+    ])
+    def test_is_duplicate(self, docs, date, description, tag, expected):
+        api._cache_documents(1, docs)
+        assert is_duplicate(FAKE_CONFIG, 1, date, description, tag) is expected
+
+    def test_fetches_and_indexes_all_pages_once(self, mock_request):
+        mock_request.side_effect = [
+            mock_response({"results": [
+                {"date": "2025-01-01", "description": "CBC", "metatags": '["laboratory"]'},
+            ], "next": "https://app.drchrono.com/api/documents?page=2"}),
+            mock_response({"results": [
+                {"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'},
+            ], "next": None}),
+        ]
+        assert len(api.get_patient_documents(FAKE_CONFIG, 1)) == 2
         assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is True
+        assert is_duplicate(FAKE_CONFIG, 1, "2025-01-01", "CBC", "laboratory") is True
+        assert is_duplicate(FAKE_CONFIG, 1, "2025-01-01", "CBC", "radiology") is False
+        assert mock_request.call_count == 2
 
-    def test_metatags_null(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": None},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is False
-
-    def test_metatags_empty_string(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": ""},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is False
-
-    def test_metatags_malformed_json(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": "{bad json"},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is False
-
-    def test_no_existing_documents(self):
-        self._setup_docs_cache(1, [])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is False
-
-    def test_multiple_docs_one_matches(self):
-        self._setup_docs_cache(1, [
-            {"date": "2025-01-01", "description": "CBC", "metatags": '["laboratory"]'},
+    def test_unchanged_list_revalidated_from_disk(self, mock_request):
+        docs = [{"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'}]
+        mock_request.side_effect = [
+            mock_response({"results": docs, "next": None}, headers={"ETag": '"v1"'}),
+            mock_response(status_code=304),
+        ]
+        api.get_patient_documents(FAKE_CONFIG, 1)
+
+        # New run: in-memory cache gone, server confirms the saved list is current
+        api._documents_cache.clear()
+        assert api.get_patient_documents(FAKE_CONFIG, 1) == docs
+        assert mock_request.calls[-1][1]["headers"]["If-None-Match"] == '"v1"'
+
+    def test_only_duplicate_check_fields_persisted(self, mock_request):
+        doc = {"id": 5, "date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]',
+               "document": "https://example.com/cxr.pdf", "patient": 1}
+        mock_request.return_value = mock_response({"results": [doc], "next": None}, headers={"ETag": '"v1"'})
+        api.get_patient_documents(FAKE_CONFIG, 1)
+        _etag, _last_modified, saved = api._load_cached_documents(1)
+        assert saved == [{"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'}]
+
+    def test_full_record_table_dropped_once(self):
+        conn = sqlite3.connect(config.DOCUMENTS_CACHE_FILE)
+        conn.execute("CREATE TABLE documents (patient_id INTEGER PRIMARY KEY, docs TEXT)")
+        conn.close()
+
+        api._disk_cache_connect().close()
+        conn = api._disk_cache_connect()
+        try:
+            tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            assert tables == {"document_keys"}
+            # Later connections leave the file's tables alone
+            conn.execute("CREATE TABLE documents (x)")
+            conn.commit()
+        finally:
+            conn.close()
+        api._disk_cache_connect().close()
+        conn = sqlite3.connect(config.DOCUMENTS_CACHE_FILE)
+        try:
+            assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'documents'").fetchone()
+        finally:
+            conn.close()
+
+    def test_expired_entry_ignored(self, mock_request, monkeypatch):
+        mock_request.return_value = mock_response({"results": [], "next": None}, headers={"ETag": '"v1"'})
+        api.get_patient_documents(FAKE_CONFIG, 1)
+        later = time.time() + api.DOCUMENTS_CACHE_MAX_AGE + 1
+        monkeypatch.setattr(api.time, "time", lambda: later)
+        assert api._load_cached_documents(1) is None
+
+    def test_clear_documents_cache(self, mock_request):
+        mock_request.return_value = mock_response({"results": [], "next": None}, headers={"ETag": '"v1"'})
+        api.get_patient_documents(FAKE_CONFIG, 1)
+        api.clear_documents_cache()
+        assert api._load_cached_documents(1) is None
+        api.clear_documents_cache()  # nothing left to remove
+
+    def test_multi_page_list_not_persisted(self, mock_request):
+        mock_request.side_effect = [
+            mock_response({"results": [], "next": "https://app.drchrono.com/api/documents?page=2"},
+                           headers={"ETag": '"v1"'}),
+            _LAST_EMPTY_PAGE,
+        ]
+        api.get_patient_documents(FAKE_CONFIG, 1)
+        assert api._load_cached_documents(1) is None
+
+    def test_uncached_patient_probed_with_filtered_query(self, mock_request):
+        mock_request.return_value = mock_response({"results": [
             {"date": "2026-02-03", "description": "CXR", "metatags": '["radiology"]'},
-        ])
-        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is True
-
-    def test_multiple_tags_in_metatags(self):
-        self._setup_docs_cache(1, [
-            {"date": "2026-02-03", "description": "CXR", "metatags": '["laboratory", "radiology"]'},
-        ])
+        ], "next": None})
         assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is True
+        assert mock_request.call_count == 1
+        params = mock_request.calls[-1][1]["params"]
+        assert params["date_range"] == "2026-02-03/2026-02-03"
+        assert 1 not in api._documents_cache
+
+    def test_rejected_filter_falls_back_once(self, mock_request):
+        mock_request.side_effect = [
+            mock_response({"detail": "bad filter"}, status_code=400),
+            _LAST_EMPTY_PAGE,
+            _LAST_EMPTY_PAGE,
+        ]
+        assert is_duplicate(FAKE_CONFIG, 1, "2026-02-03", "CXR", "radiology") is False
+        assert is_duplicate(FAKE_CONFIG, 2, "2026-02-03", "CXR", "radiology") is False
+        assert api._document_filter_supported is False
+        # Patient 2 skips the probe and goes straight to the full list
+        assert mock_request.call_count == 3
 
 
 # -----------------------------------------------------------------------
@@ -278,22 +314,16 @@ class TestIsDuplicate:
 # -----------------------------------------------------------------------
 
 class TestUploadDocument:
-    @patch("src.api.requests.request")
-    def test_success(self, mock_request, tmp_path):
-        test_file = tmp_path / "test.pdf"
-        test_file.write_text("fake pdf")
-        mock_request.return_value = _mock_response({"id": 999}, status_code=201)
+    def test_success(self, mock_request, fake_pdf):
+        mock_request.return_value = mock_response({"id": 999}, status_code=201)
 
-        result = upload_document(FAKE_CONFIG, str(test_file), 1, 2, "2026-02-03", "CXR", "radiology")
+        result = upload_document(FAKE_CONFIG, fake_pdf, 1, 2, "2026-02-03", "CXR", "radiology")
         assert result.status == UploadStatus.SUCCESS
         assert result.document_id == 999
 
-    @patch("src.api.requests.request")
-    def test_failure(self, mock_request, tmp_path):
-        test_file = tmp_path / "test.pdf"
-        test_file.write_text("fake pdf")
-        mock_request.return_value = _mock_response({"error": "bad request"}, status_code=400)
+    def test_failure(self, mock_request, fake_pdf):
+        mock_request.return_value = mock_response({"error": "bad request"}, status_code=400)
 
-        result = upload_document(FAKE_CONFIG, str(test_file), 1, 2, "2026-02-03", "CXR", "radiology")
+        result = upload_document(FAKE_CONFIG, fake_pdf, 1, 2, "2026-02-03", "CXR", "radiology")
         assert result.status == UploadStatus.FAILED
         assert "400" in result.detail
@@ -0,0 +1,106 @@
+"""Tests for the OAuth callback, token bookkeeping and proactive refresh."""
+
+import socket
+import threading
+import time
+from unittest.mock import patch
+
+from src import auth
+
+
+def _expiring_in(seconds):
+    return time.time() + seconds
+
+
+# -----------------------------------------------------------------------
+# _store_tokens
+# -----------------------------------------------------------------------
+
+class TestStoreTokens:
+    def test_records_expiry(self):
+        config = {}
+        auth._store_tokens(config, {"access_token": "at", "refresh_token": "rt", "expires_in": 3600})
+        assert config["access_token"] == "at"
+        assert not auth._token_expiring(config)
+
+    def test_sets_session_bearer(self):
+        auth._store_tokens({}, {"access_token": "at", "refresh_token": "rt"})
+        assert auth.session.headers["Authorization"] == "Bearer at"
+
+    def test_drops_stale_expiry_without_expires_in(self):
+        config = {"expires_at_epoch": _expiring_in(-10)}
+        auth._store_tokens(config, {"access_token": "at", "refresh_token": "rt"})
+        assert "expires_at_epoch" not in config
+
+
+# -----------------------------------------------------------------------
+# refresh_if_expiring
+# -----------------------------------------------------------------------
+
+class TestRefreshIfExpiring:
+    @patch("src.auth.refresh_token")
+    def test_no_refresh_when_expiry_unknown(self, mock_refresh):
+        auth.refresh_if_expiring({"access_token": "at"})
+        mock_refresh.assert_not_called()
+
+    @patch("src.auth.refresh_token")
+    def test_no_refresh_when_token_fresh(self, mock_refresh):
+        auth.refresh_if_expiring({"access_token": "at", "expires_at_epoch": _expiring_in(3600)})
+        mock_refresh.assert_not_called()
+
+    @patch("src.auth.refresh_token")
+    def test_refreshes_within_skew(self, mock_refresh):
+        config = {"access_token": "at", "expires_at_epoch": _expiring_in(30)}
+        auth.refresh_if_expiring(config)
+        mock_refresh.assert_called_once_with(config)
+
+    def test_concurrent_callers_refresh_once(self):
+        config = {"access_token": "old", "expires_at_epoch": _expiring_in(5)}
+        calls = []
+
+        def _fake_refresh(cfg):
+            calls.append(1)
+            time.sleep(0.02)
+            cfg["expires_at_epoch"] = _expiring_in(3600)
+            return cfg
+
+        with patch("src.auth.refresh_token", side_effect=_fake_refresh):
+            threads = [threading.Thread(target=auth.refresh_if_expiring, args=(config,)) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        assert len(calls) == 1
+
+
+# -----------------------------------------------------------------------
+# OAuth redirect callback
+# -----------------------------------------------------------------------
+
+def _send_redirect(port, path):
+    with socket.create_connection(("localhost", port)) as client:
+        client.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        return client.recv(4096)
+
+
+class TestAcceptCallback:
+    def _roundtrip(self, path):
+        with auth._listen_for_callback(port=0) as sock:
+            port = sock.getsockname()[1]
+            replies = []
+            client = threading.Thread(target=lambda: replies.append(_send_redirect(port, path)))
+            client.start()
+            code = auth._accept_callback(sock)
+            client.join()
+        return code, replies[0]
+
+    def test_returns_code(self):
+        code, reply = self._roundtrip("/callback?code=abc123&state=x")
+        assert code == "abc123"
+        assert reply.startswith(b"HTTP/1.1 200 OK")
+        assert reply.endswith(b"Authorization successful! You can close this tab.")
+
+    def test_error_denied(self):
+        code, reply = self._roundtrip("/callback?error=access_denied")
+        assert code is None
+        assert reply.startswith(b"HTTP/1.1 400")
@@ -1,21 +1,36 @@
 """Tests for configuration loading, saving, and metatag loading."""
 
 import json
-from unittest.mock import patch
+import os
+import stat
+from unittest.mock import MagicMock, patch
 
 import pytest
 
 from src import config
 
 
-@pytest.fixture(autouse=True)
-def _isolate_paths(tmp_path, monkeypatch):
-    """Point all file paths at tmp_path for every test."""
-    monkeypatch.setattr(config, "APP_DIR", str(tmp_path))
-    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path))
-    monkeypatch.setattr(config, "CONFIG_FILE", str(tmp_path / "config.json"))
-    monkeypatch.setattr(config, "METATAG_FILE", str(tmp_path / "metatag.json"))
-    monkeypatch.setattr(config, "SETTINGS_FILE", str(tmp_path / "settings.json"))
+def _point_paths_at(mp, directory):
+    mp.setattr(config, "APP_DIR", str(directory))
+    mp.setattr(config, "DATA_DIR", str(directory))
+    mp.setattr(config, "CONFIG_FILE", str(directory / "config.json"))
+    mp.setattr(config, "METATAG_FILE", str(directory / "metatag.json"))
+    mp.setattr(config, "SETTINGS_FILE", str(directory / "settings.json"))
+
+
+@pytest.fixture(autouse=True, scope="module")
+def _isolate_paths_module(tmp_path_factory):
+    """Point all file paths at one empty directory shared by the read-only tests."""
+    with pytest.MonkeyPatch.context() as mp:
+        _point_paths_at(mp, tmp_path_factory.mktemp("config"))
+        yield
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Give a test that writes files its own directory."""
+    _point_paths_at(monkeypatch, tmp_path)
+    return tmp_path
 
 
 # -----------------------------------------------------------------------
@@ -26,9 +41,9 @@ class TestLoadConfig:
     def test_missing_file_returns_empty_dict(self):
         assert config.load_config() == {}
 
-    def test_loads_existing_file(self, tmp_path):
+    def test_loads_existing_file(self, data_dir):
         cfg = {"client_id": "abc", "client_secret": "xyz"}
-        (tmp_path / "config.json").write_text(json.dumps(cfg))
+        (data_dir / "config.json").write_text(json.dumps(cfg))
         assert config.load_config() == cfg
 
 
@@ -37,16 +52,37 @@ class TestLoadConfig:
 # -----------------------------------------------------------------------
 
 class TestSaveConfig:
-    def test_writes_json(self, tmp_path):
+    def test_writes_json(self, data_dir):
         cfg = {"client_id": "abc", "access_token": "tok123"}
         config.save_config(cfg)
-        written = json.loads((tmp_path / "config.json").read_text())
+        written = json.loads((data_dir / "config.json").read_text())
         assert written == cfg
 
-    def test_overwrites_existing(self, tmp_path):
-        (tmp_path / "config.json").write_text('{"old": true}')
+    def test_failed_write_keeps_previous_file(self, data_dir, monkeypatch):
+        (data_dir / "config.json").write_text('{"old": true}')
+        monkeypatch.setattr(config.os, "replace", MagicMock(side_effect=OSError("disk full")))
+        with pytest.raises(OSError):
+            config.save_config({"new": True})
+        assert json.loads((data_dir / "config.json").read_text()) == {"old": True}
+        assert [p.name for p in data_dir.iterdir()] == ["config.json"]  # temp file cleaned up
+
+    @pytest.mark.skipif(os.name == "nt", reason="POSIX permission bits")
+    def test_new_file_is_owner_only(self, data_dir):
+        config.save_config({"client_secret": "s"})
+        assert stat.S_IMODE((data_dir / "config.json").stat().st_mode) == 0o600
+
+    @pytest.mark.skipif(os.name == "nt", reason="POSIX permission bits")
+    def test_keeps_existing_mode(self, data_dir):
+        path = data_dir / "config.json"
+        path.write_text("{}")
+        path.chmod(0o640)
+        config.save_config({"new": True})
+        assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+    def test_overwrites_existing(self, data_dir):
+        (data_dir / "config.json").write_text('{"old": true}')
         config.save_config({"new": True})
-        written = json.loads((tmp_path / "config.json").read_text())
+        written = json.loads((data_dir / "config.json").read_text())
         assert written == {"new": True}
 
 
@@ -59,9 +95,9 @@ class TestLoadMetatags:
         with pytest.raises(SystemExit):
             config.load_metatags()
 
-    def test_loads_metatags(self, tmp_path):
+    def test_loads_metatags(self, data_dir):
         tags = {"L": "laboratory", "R": "radiology"}
-        (tmp_path / "metatag.json").write_text(json.dumps(tags))
+        (data_dir / "metatag.json").write_text(json.dumps(tags))
         assert config.load_metatags() == tags
 
 
@@ -76,10 +112,10 @@ class TestEnsureCredentials:
         assert result == cfg
 
     @patch("builtins.input", side_effect=["my-id", "my-secret"])
-    def test_prompts_when_missing(self, mock_input, tmp_path):
+    def test_prompts_when_missing(self, mock_input, data_dir):
         result = config.ensure_credentials({})
         assert result["client_id"] == "my-id"
         assert result["client_secret"] == "my-secret"
         # Should also persist to disk
-        saved = json.loads((tmp_path / "config.json").read_text())
+        saved = json.loads((data_dir / "config.json").read_text())
         assert saved["client_id"] == "my-id"
@@ -40,35 +40,53 @@ def isolated_config(monkeypatch, tmp_path):
     return tmp_path
 
 
-@pytest.fixture
-def mock_keyring(monkeypatch):
-    """Provide a mock keyring module with in-memory storage and mark keyring as available."""
-    storage: dict[str, str] = {}
+class _StubKeyring:
+    """In-memory stand-in for the keyring module with plain call counters."""
+
+    class errors:
+        class PasswordDeleteError(Exception):
+            pass
 
-    kr = MagicMock()
-    kr.get_password = MagicMock(side_effect=lambda svc, key: storage.get(f"{svc}:{key}"))
-    kr.set_password = MagicMock(
-        side_effect=lambda svc, key, val: storage.__setitem__(f"{svc}:{key}", val)
-    )
+    def __init__(self):
+        self.storage: dict[str, str] = {}
+        self.reset()
 
-    class _PasswordDeleteError(Exception):
-        pass
+    def reset(self):
+        self.storage.clear()
+        self.get_calls = 0
+        self.set_calls = 0
 
-    kr.errors = MagicMock()
-    kr.errors.PasswordDeleteError = _PasswordDeleteError
+    def get_password(self, svc, key):
+        self.get_calls += 1
+        return self.storage.get(f"{svc}:{key}")
 
-    def _delete(svc, key):
+    def set_password(self, svc, key, val):
+        self.set_calls += 1
+        self.storage[f"{svc}:{key}"] = val
+
+    def delete_password(self, svc, key):
         full_key = f"{svc}:{key}"
-        if full_key not in storage:
-            raise _PasswordDeleteError("not found")
-        del storage[full_key]
+        if full_key not in self.storage:
+            raise self.errors.PasswordDeleteError("not found")
+        del self.storage[full_key]
+
 
-    kr.delete_password = MagicMock(side_effect=_delete)
+@pytest.fixture(scope="session")
+def _keyring_stub():
+    """Build the fake keyring once; mock_keyring resets it per test."""
+    return _StubKeyring()
+
+
+@pytest.fixture
+def mock_keyring(monkeypatch, _keyring_stub):
+    """Provide a fake keyring module with in-memory storage and mark keyring as available."""
+    kr = _keyring_stub
+    kr.reset()
 
     monkeypatch.setattr(credential_store, "_keyring_available", True)
-    monkeypatch.setitem(__import__("sys").modules, "keyring", kr)
+    monkeypatch.setattr(credential_store, "_keyring_mod", kr)
 
-    return kr, storage
+    return kr, kr.storage
 
 
 # ---------------------------------------------------------------------------
@@ -96,6 +114,17 @@ class TestKeyringAvailable:
         assert blob["client_id"] == "id1"
         assert blob["client_secret"] == "sec1"
 
+    def test_set_many_writes_blob_once(self, mock_keyring):
+        kr, storage = mock_keyring
+        credential_store.set_many({"client_id": "id1", "client_secret": "sec1", "refresh_token": "rt1"})
+        assert kr.get_calls == 1
+        assert kr.set_calls == 1
+
+    def test_set_many_access_token_not_persisted(self, mock_keyring):
+        kr, storage = mock_keyring
+        credential_store.set_many({"access_token": "at", "refresh_token": "rt1"})
+        assert _get_blob(storage) == {"refresh_token": "rt1"}
+
     def test_set_preserves_existing_blob_keys(self, mock_keyring):
         kr, storage = mock_keyring
         _set_blob(storage, {"client_id": "id1", "client_secret": "sec1"})
@@ -126,6 +155,12 @@ class TestKeyringAvailable:
         assert result["client_secret"] is None
         assert result["access_token"] is None  # session-only, no active session
 
+    def test_get_all_reads_keyring_once(self, mock_keyring):
+        kr, storage = mock_keyring
+        _set_blob(storage, {"client_id": "id1", "refresh_token": "rt1"})
+        assert credential_store.get_all()["refresh_token"] == "rt1"
+        assert kr.get_calls == 1
+
     def test_invalid_key_raises(self, mock_keyring):
         with pytest.raises(ValueError, match="Unknown credential key"):
             credential_store.get("bogus")
@@ -184,6 +219,25 @@ class TestKeyringUnavailable:
         assert "client_id" not in cfg
         assert cfg["other"] == "y"
 
+    def test_repeated_gets_read_config_once(self, isolated_config):
+        _write_config(isolated_config, {"client_id": "from-file", "client_secret": "s"})
+        with patch("builtins.open", wraps=open) as mock_open:
+            for _ in range(5):
+                assert credential_store.get("client_id") == "from-file"
+        assert mock_open.call_count == 1
+
+    def test_get_sees_external_config_change(self, isolated_config):
+        _write_config(isolated_config, {"client_id": "old"})
+        assert credential_store.get("client_id") == "old"
+        _write_config(isolated_config, {"client_id": "newer-id"})
+        assert credential_store.get("client_id") == "newer-id"
+
+    def test_set_updates_cached_config(self, isolated_config):
+        _write_config(isolated_config, {"client_id": "old"})
+        credential_store.get("client_id")
+        credential_store.set("client_id", "new-id")
+        assert credential_store.get("client_id") == "new-id"
+
     def test_warns_when_keyring_unavailable(self, monkeypatch):
         """First check of keyring availability should issue a warning."""
         monkeypatch.setattr(credential_store, "_keyring_available", None)
@@ -275,10 +329,29 @@ class TestSessionCache:
         assert credential_store.get("refresh_token") == "cached-rt"
 
         # Keyring only accessed during load_session, not on subsequent get()
-        initial_calls = kr.get_password.call_count
+        initial_calls = kr.get_calls
         credential_store.get("client_id")
         credential_store.get("refresh_token")
-        assert kr.get_password.call_count == initial_calls
+        assert kr.get_calls == initial_calls
+
+    def test_unchanged_blob_parsed_once(self, mock_keyring, monkeypatch):
+        kr, storage = mock_keyring
+        _set_blob(storage, {"client_id": "id1", "client_secret": "sec1"})
+        loads = MagicMock(wraps=json.loads)
+        monkeypatch.setattr(credential_store.json, "loads", loads)
+
+        for _ in range(3):
+            assert credential_store.get("client_id") == "id1"
+        assert loads.call_count == 1
+
+    def test_written_blob_not_reparsed(self, mock_keyring, monkeypatch):
+        kr, storage = mock_keyring
+        credential_store.set("client_id", "id1")
+        loads = MagicMock(wraps=json.loads)
+        monkeypatch.setattr(credential_store.json, "loads", loads)
+
+        assert credential_store.get("client_id") == "id1"
+        assert loads.call_count == 0
 
     def test_clear_session_wipes_cache(self, mock_keyring):
         kr, storage = mock_keyring
@@ -290,7 +363,7 @@ class TestSessionCache:
         credential_store.clear_session()
         # After clearing, get() goes back to keyring (one more read)
         assert credential_store.get("client_id") == "cached-id"
-        assert kr.get_password.call_count > 0
+        assert kr.get_calls > 0
 
     def test_set_updates_session_cache_and_keyring(self, mock_keyring):
         kr, storage = mock_keyring
@@ -1,8 +1,13 @@
 """Tests for filename pattern compilation and parsing."""
 
+import gc
+import re
+import weakref
+
 import pytest
 
-from src.parser import compile_pattern, parse_filename, parse_date_mmddyy, DEFAULT_PATTERN
+from src.parser import compile_pattern, parse_filename, parse_filenames, parse_date_mmddyy, DEFAULT_PATTERN
+from src import parser
 
 METATAGS = {
     "L": "laboratory",
@@ -17,8 +22,9 @@ METATAGS = {
 }
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def default_re():
+    # Compiled patterns are immutable, so every test in the module can share one
     return compile_pattern(DEFAULT_PATTERN, METATAGS)
 
 
@@ -51,6 +57,9 @@ class TestParseDateMmddyy:
     def test_non_numeric(self):
         assert parse_date_mmddyy("abcdef") is None
 
+    def test_non_ascii_digits(self):
+        assert parse_date_mmddyy("0203\u00b26") is None
+
 
 # -----------------------------------------------------------------------
 # Default pattern: {name}_{tag}_{date}_{description}
@@ -112,6 +121,13 @@ class TestDefaultPattern:
         assert result.tag_code == "MI"
         assert result.tag_full == "miscellaneous"
 
+    def test_tag_full_shares_metatag_string(self, default_re):
+        a = parse_filename("DOE,JANE_R_020326_CXR.pdf", METATAGS, default_re)
+        b = parse_filename("SMITH,JOHN_R_010226_MRI.pdf", METATAGS, default_re)
+        # No per-result copy: every result points at the metatag map's own value
+        assert a.tag_full is METATAGS["R"]
+        assert b.tag_full is a.tag_full
+
     def test_unknown_tag_returns_none(self, default_re):
         result = parse_filename("DOE,JANE_X_020326_CXR.pdf", METATAGS, default_re)
         assert result is None
@@ -124,6 +140,42 @@ class TestDefaultPattern:
         result = parse_filename("badfile.pdf", METATAGS, default_re)
         assert result is None
 
+    @pytest.mark.parametrize("filename", [
+        ".DS_Store", "Thumbs.db", "DOE JANE_R_020326_CXR.pdf", "DOE,JANE_R_0203_CXR.pdf", "DOE,JANE_R_020326CXR.pdf",
+    ])
+    def test_prefilter_rejects(self, default_re, filename):
+        assert parse_filename(filename, METATAGS, default_re) is None
+
+    def test_batch_matches_single(self, default_re):
+        names = ["DOE,JANE_R_020326_CXR.pdf", ".DS_Store", "SMITH,JOHN_L_120124_CBC.pdf", "badfile.pdf"]
+        assert parse_filenames(names, METATAGS, default_re) == [
+            parse_filename(n, METATAGS, default_re) for n in names
+        ]
+
+    @pytest.mark.parametrize("filename", [
+        "DOE,JANE_R_020326_CXR.pdf",
+        "DOE, JANE, M_R_020326_CXR.pdf",
+        "DOE,JANE, _R_020326_CXR.pdf",
+        "DOE,JANE,_R_020326_CXR.pdf",
+        "DOE,JANE,M,X_R_020326_CXR.pdf",
+        "DOE,,JANE_R_020326_CXR.pdf",
+        ",JANE_R_020326_CXR.pdf",
+        "DOE, _R_020326_CXR.pdf",
+        "DOE,JANE_R_020326_ .pdf",
+        "DOE,JANE_R_020326_.pdf",
+        "DOE,JANE_R_02032X_CXR.pdf",
+        "DOE,JANE_R_023226_CXR.pdf",
+        "DOE,JANE_ZZ_020326_CXR.pdf",
+        "DOE,JANE_R_020326_CXR\n.pdf",
+        "DOE,JANE(010190)_R_020326_CXR.pdf",
+        "DOE,JANE_R_020326_CHEST_X_RAY.pdf",
+        "DOE_JANE_R_020326.pdf",
+    ])
+    def test_split_fast_path_matches_regex(self, default_re, filename):
+        regex_only = parser._parse(filename, METATAGS, default_re.match, parser._REQUIRED_CHARS[default_re])
+        assert default_re in parser._SPLIT_SPECS
+        assert parse_filename(filename, METATAGS, default_re) == regex_only
+
     def test_no_extension(self, default_re):
         result = parse_filename("DOE,JANE_R_020326_CXR", METATAGS, default_re)
         assert result is not None
@@ -192,6 +244,24 @@ class TestDefaultPattern:
 # -----------------------------------------------------------------------
 
 class TestCustomPatterns:
+    @pytest.mark.parametrize("pattern, filename", [
+        ("{last_name}-{first_name}-{tag}-{date}-{description}", "DOE-JANE-R-020326-CXR.pdf"),
+        ("{last_name}-{first_name}-{tag}-{date}-{description}", "DOE-JANE-R-020326-CHEST-XRAY.pdf"),
+        ("{last_name}-{first_name}-{tag}-{date}-{description}", "DOE-JANE-XX-020326-CXR.pdf"),
+        ("{tag}_{name}_{date}_{description}", "R_DOE, JANE, M_020326_CXR.pdf"),
+        ("{tag}_{last_name}_{first_name}_{middle_initial}_{date}_{description}", "R_DOE_JANE_M_020326_CXR.pdf"),
+        ("{tag}_{last_name}_{first_name}_{middle_initial}_{date}_{description}", "R_DOE_JANE_m_020326_CXR.pdf"),
+        ("{description}_{tag}_{date}_{name}", "CXR_R_020326_DOE,JANE.pdf"),
+        ("{last_name}_{first_name}_{dob}_{tag}_{date}_{description}", "DOE_JANE_023290_R_020326_CXR.pdf"),
+        ("{last_name}_{first_name}({dob})_{tag}_{date}({description})", "DOE_JANE_R_020326.pdf"),
+        ("{last_name}_{first_name}({dob})_{tag}_{date}({description})", "DOE_JANE(010190)_R_020326(CXR).pdf"),
+    ])
+    def test_split_fast_path_matches_regex(self, pattern, filename):
+        pattern_re = compile_pattern(pattern, METATAGS)
+        assert pattern_re in parser._SPLIT_SPECS
+        regex_only = parser._parse(filename, METATAGS, pattern_re.match, parser._REQUIRED_CHARS[pattern_re])
+        assert parse_filename(filename, METATAGS, pattern_re) == regex_only
+
     def test_separate_name_fields(self):
         pattern = "{last_name}_{first_name}_{tag}_{date}_{description}"
         pattern_re = compile_pattern(pattern, METATAGS)
@@ -349,10 +419,73 @@ class TestCompilePattern:
         with pytest.raises(ValueError, match="description"):
             compile_pattern("{name}_{tag}_{date}", METATAGS)
 
+    def test_missing_tag_raises(self):
+        with pytest.raises(ValueError, match="tag"):
+            compile_pattern("{name}_{date}_{description}", METATAGS)
+
+    def test_missing_date_raises(self):
+        with pytest.raises(ValueError, match="date"):
+            compile_pattern("{name}_{tag}_{description}", METATAGS)
+
     def test_unknown_placeholder_raises(self):
         with pytest.raises(ValueError, match="Unknown placeholder"):
             compile_pattern("{name}_{tag}_{date}_{bogus}", METATAGS)
 
+    def test_prefix_sharing_tags_prefer_longest(self):
+        tags = {"H": "history", "HP": "h&p/consults", "HPI": "present illness"}
+        pattern_re = compile_pattern(DEFAULT_PATTERN, tags)
+        for code in ("H", "HP", "HPI"):
+            result = parse_filename(f"DOE,JANE_{code}_020326_NOTE.pdf", tags, pattern_re)
+            assert result is not None
+            assert result.tag_code == code
+            assert result.description == "NOTE"
+
+    def test_compiled_pattern_is_cached(self):
+        first = compile_pattern(DEFAULT_PATTERN, METATAGS)
+        assert compile_pattern(DEFAULT_PATTERN, dict(METATAGS)) is first
+        assert compile_pattern(DEFAULT_PATTERN, {**METATAGS, "X": "extra"}) is not first
+
+    def test_side_tables_release_evicted_patterns(self):
+        """Prefilter and split data don't keep patterns the compile cache dropped alive."""
+        evicted = weakref.ref(compile_pattern(DEFAULT_PATTERN, {**METATAGS, "EVICT": "extra"}))
+        for i in range(parser._compile_pattern_cached.cache_info().maxsize):
+            compile_pattern(DEFAULT_PATTERN, {**METATAGS, f"X{i}": "extra"})
+        re.purge()  # re's own cache holds compiled patterns too
+        gc.collect()
+        assert evicted() is None
+
+    def test_prefilter_requires_template_delimiters(self):
+        from src.parser import _REQUIRED_CHARS
+        dashed = compile_pattern("{name}-{tag}-{date}-{description}", METATAGS)
+        assert _REQUIRED_CHARS[dashed] == ((",", 1), ("-", 3))
+        # ({dob}) is optional, so its parentheses are not required
+        assert _REQUIRED_CHARS[compile_pattern(DEFAULT_PATTERN, METATAGS)] == ((",", 1), ("_", 3))
+
+    def test_only_trailing_description_is_possessive(self):
+        assert "(?P<description>.++)" in compile_pattern(DEFAULT_PATTERN, METATAGS).pattern
+        leading = compile_pattern("{description}_{tag}_{date}_{name}", METATAGS)
+        assert "(?P<description>.+)" in leading.pattern
+
+    @pytest.mark.parametrize("pattern, expected", [
+        (DEFAULT_PATTERN, ("_", ("name", "tag", "date", "description"), True)),
+        ("{last_name}-{first_name}-{tag}-{date}-{description}",
+         ("-", ("last_name", "first_name", "tag", "date", "description"), False)),
+        ("{tag}_{name}_{date}_{description}", ("_", ("tag", "name", "date", "description"), False)),
+        ("{name}-{tag}_{date}_{description}", None),  # mixed delimiters
+        ("{name}__{tag}__{date}__{description}", None),  # multi-character delimiter
+        ("X{name}_{tag}_{date}_{description}", None),  # leading literal
+        ("{last_name}({dob}){first_name}_{tag}_{date}_{description}", None),  # undelimited fields
+    ])
+    def test_split_spec_detection(self, pattern, expected):
+        spec = parser._SPLIT_SPECS.get(compile_pattern(pattern, METATAGS))
+        assert (spec[:3] if spec else None) == expected
+
+    def test_split_spec_skipped_when_tag_contains_delimiter(self):
+        tags = {**METATAGS, "X_RAY": "radiology"}
+        pattern_re = compile_pattern(DEFAULT_PATTERN, tags)
+        assert pattern_re not in parser._SPLIT_SPECS
+        assert parse_filename("DOE,JANE_X_RAY_020326_CXR.pdf", tags, pattern_re).tag_code == "X_RAY"
+
     def test_default_pattern_compiles(self):
         pattern_re = compile_pattern(DEFAULT_PATTERN, METATAGS)
         assert pattern_re is not None
@@ -1,21 +1,32 @@
 """Tests for batch directory processing."""
 
+import errno
 import re
+import threading
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 
 import pytest
 import requests
 
+from src import api
 from src.api import RateLimitError
-from src.parser import compile_pattern, DEFAULT_PATTERN
-from src.processor import process_directory, _INTER_FILE_SLEEP
+from src.parser import compile_pattern, parse_filenames, DEFAULT_PATTERN
+from src.processor import (
+    process_directory,
+    _INTER_FILE_SLEEP,
+    _WORKER_JITTER_MAX,
+    _Pacer,
+    _prefetch_documents,
+    _prefetch_patients,
+)
 from src.types import (
     PatientLookupResult,
     PatientLookupStatus,
     UploadResult,
     UploadStatus,
 )
+from tests.fakes import mock_response
 
 METATAGS = {
     "L": "laboratory",
@@ -26,11 +37,24 @@ METATAGS = {
 FAKE_CONFIG = {"access_token": "test-token"}
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def pattern_re():
     return compile_pattern(DEFAULT_PATTERN, METATAGS)
 
 
+@pytest.fixture(autouse=True)
+def _skip_sleeps(monkeypatch):
+    """Don't wait out start jitter and pacing; tests that check them patch sleep themselves."""
+    monkeypatch.setattr("src.processor.time.sleep", lambda seconds: None)
+
+
+@pytest.fixture(autouse=True)
+def mock_docs():
+    """Document listings the pre-pass fetches; tests that check them patch their own."""
+    with patch("src.processor.get_patient_documents", return_value=[]) as mock:
+        yield mock
+
+
 @pytest.fixture
 def doc_dir(tmp_path):
     """Create a temp directory with sample files."""
@@ -195,6 +219,25 @@ class TestDestDir:
         assert (doc_dir / "DOE,JANE_R_020326_CXR.pdf").exists()
         assert not (dest / "DOE,JANE_R_020326_CXR.pdf").exists()
 
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    @patch("src.processor.find_patient")
+    def test_cross_device_move_falls_back_to_copy(self, mock_find, mock_dup, mock_upload, doc_dir, pattern_re,
+                                                  tmp_path, monkeypatch):
+        mock_find.return_value = _found_patient()
+        mock_upload.return_value = _upload_ok()
+        dest = tmp_path / "done"
+
+        def _replace(src, dst):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        monkeypatch.setattr("src.processor.os.replace", _replace)
+
+        process_directory(FAKE_CONFIG, str(doc_dir), METATAGS, pattern_re, dest_dir=str(dest))
+
+        assert (dest / "DOE,JANE_R_020326_CXR.pdf").exists()
+        assert not (doc_dir / "DOE,JANE_R_020326_CXR.pdf").exists()
+
 
 # -----------------------------------------------------------------------
 # Multi-worker
@@ -228,6 +271,30 @@ class TestMultiWorker:
         assert (dest / "DOE,JANE_R_020326_CXR.pdf").exists()
         assert (dest / "SMITH,JOHN_L_120124_CBC.pdf").exists()
 
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    @patch("src.processor.find_patient")
+    def test_multi_worker_report_in_directory_order(self, mock_find, mock_dup, mock_upload, doc_dir, pattern_re, capsys):
+        mock_find.return_value = _not_found()
+
+        process_directory(FAKE_CONFIG, str(doc_dir), METATAGS, pattern_re, num_workers=2)
+
+        report = capsys.readouterr().out.split("--- Failed Files")[1]
+        assert report.index("DOE,JANE_R_020326_CXR.pdf") < report.index("SMITH,JOHN_L_120124_CBC.pdf")
+
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    @patch("src.processor.find_patient")
+    def test_workers_capped_at_file_count(self, mock_find, mock_dup, mock_upload, doc_dir, pattern_re, capsys):
+        mock_find.return_value = _found_patient()
+        mock_upload.return_value = _upload_ok()
+
+        process_directory(FAKE_CONFIG, str(doc_dir), METATAGS, pattern_re, num_workers=20)
+
+        output = capsys.readouterr().out
+        assert "Using 3 worker(s)" in output
+        assert "Uploaded:      2" in output
+
 
 # -----------------------------------------------------------------------
 # Edge cases
@@ -362,31 +429,88 @@ class TestRateLimitHandling:
         assert "Rate-limited:  2" in output
         assert "Failed:        0" in output
 
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate")
+    @patch("src.processor.find_patient")
+    def test_retry_notice_in_file_block(self, mock_find, mock_dup, mock_upload, tmp_path, pattern_re, capsys):
+        """A backoff notice from the API lands inside the file's log block, tagged with its worker."""
+        (tmp_path / "DOE,JANE_R_020326_CXR.pdf").write_text("fake")
+        mock_find.return_value = _found_patient()
+
+        def _throttled_dup(*args):
+            api.retry_log.get()("[RATE LIMIT] 429 received")
+            return True
+
+        mock_dup.side_effect = _throttled_dup
+
+        process_directory(FAKE_CONFIG, str(tmp_path), METATAGS, pattern_re, dry_run=True)
+
+        lines = capsys.readouterr().out.splitlines()
+        start = lines.index("  [W1] Processing: DOE,JANE_R_020326_CXR.pdf")
+        assert "  [W1]   [RATE LIMIT] 429 received" in lines[start:]
+
 
 # -----------------------------------------------------------------------
 # Inter-file sleep
 # -----------------------------------------------------------------------
 
+def _inter_file_sleeps(mock_sleep) -> list[float]:
+    """Pacing sleeps, told apart from the start jitter by length."""
+    return [c[0][0] for c in mock_sleep.call_args_list if c[0][0] > _WORKER_JITTER_MAX]
+
+
 class TestInterFileSleep:
     @patch("src.processor.time.sleep")
     @patch("src.processor.upload_document")
     @patch("src.processor.is_duplicate", return_value=False)
     @patch("src.processor.find_patient")
     def test_sleep_between_files(self, mock_find, mock_dup, mock_upload, mock_sleep, doc_dir, pattern_re):
-        """Workers sleep between consecutive files (not before the first)."""
+        """Workers sleep between consecutive API-touching files (not before the first)."""
         mock_find.return_value = _found_patient()
         mock_upload.return_value = _upload_ok()
 
         process_directory(FAKE_CONFIG, str(doc_dir), METATAGS, pattern_re)
 
-        # 3 files total, worker processes them sequentially
-        # Sleep calls: 1 jitter + inter-file sleeps between non-first files
-        inter_file_sleeps = [
-            c for c in mock_sleep.call_args_list
-            if c[0][0] == _INTER_FILE_SLEEP
-        ]
-        # 3 files = 2 inter-file sleeps (before file 2 and 3)
-        assert len(inter_file_sleeps) == 2
+        # Sleep calls: 1 jitter + the gaps between API-touching calls. The
+        # pre-pass spaces its two lookups and the document listing for the
+        # shared patient ID; badfile.txt never calls the API.
+        *prefetch_gaps, inter_file_gap = _inter_file_sleeps(mock_sleep)
+        assert len(prefetch_gaps) == 2
+        assert inter_file_gap <= _INTER_FILE_SLEEP
+
+    @patch("src.processor.time.sleep")
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    @patch("src.processor.find_patient")
+    def test_api_time_counts_toward_gap(self, mock_find, mock_dup, mock_upload, mock_sleep, doc_dir, pattern_re):
+        """The pause is measured from the previous file's start, not its end."""
+        mock_find.return_value = _found_patient()
+
+        def _slow_upload(*args):
+            threading.Event().wait(0.3)  # time.sleep is patched
+            return _upload_ok()
+
+        mock_upload.side_effect = _slow_upload
+
+        process_directory(FAKE_CONFIG, str(doc_dir), METATAGS, pattern_re)
+
+        *_prefetch_gaps, gap = _inter_file_sleeps(mock_sleep)
+        assert gap <= _INTER_FILE_SLEEP - 0.3
+
+    @patch("src.processor.time.sleep")
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    @patch("src.processor.find_patient")
+    def test_no_sleep_around_unparseable_files(self, mock_find, mock_dup, mock_upload, mock_sleep, tmp_path, pattern_re):
+        (tmp_path / "DOE,JANE_R_020326_CXR.pdf").write_text("fake")
+        (tmp_path / "Thumbs.db").write_text("fake")
+        (tmp_path / "notes.txt").write_text("fake")
+        mock_find.return_value = _found_patient()
+        mock_upload.return_value = _upload_ok()
+
+        process_directory(FAKE_CONFIG, str(tmp_path), METATAGS, pattern_re)
+
+        assert _inter_file_sleeps(mock_sleep) == []
 
     @patch("src.processor.time.sleep")
     @patch("src.processor.upload_document")
@@ -398,8 +522,112 @@ class TestInterFileSleep:
 
         process_directory(FAKE_CONFIG, str(doc_dir), METATAGS, pattern_re, dry_run=True)
 
-        inter_file_sleeps = [
-            c for c in mock_sleep.call_args_list
-            if c[0][0] == _INTER_FILE_SLEEP
-        ]
-        assert len(inter_file_sleeps) == 0
+        assert _inter_file_sleeps(mock_sleep) == []
+
+
+# -----------------------------------------------------------------------
+# Patient lookup pre-pass
+# -----------------------------------------------------------------------
+
+class TestPatientPrefetch:
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    def test_one_lookup_per_unique_patient(self, mock_dup, mock_upload, mock_request, tmp_path, pattern_re, capsys):
+        (tmp_path / "DOE,JANE_R_020326_CXR.pdf").write_text("fake")
+        (tmp_path / "DOE,JANE_L_020326_CBC.pdf").write_text("fake")
+        (tmp_path / "doe,jane_L_030326_BMP.pdf").write_text("fake")
+        mock_request.return_value = mock_response({"results": [
+            {"id": 42, "doctor": 7, "first_name": "JANE", "last_name": "DOE"},
+        ]})
+        mock_upload.return_value = _upload_ok()
+
+        process_directory(FAKE_CONFIG, str(tmp_path), METATAGS, pattern_re, dry_run=True)
+
+        patient_calls = [args for args, _kwargs in mock_request.calls if args[1].endswith("/api/patients")]
+        assert len(patient_calls) == 1
+        output = capsys.readouterr().out
+        assert "Looking up 1 unique patient(s)" in output
+        assert "Uploaded:      3" in output
+
+    @pytest.mark.parametrize("num_workers", [1, 2])
+    @patch("src.processor.time.sleep")
+    @patch("src.processor.find_patient", return_value=_not_found())
+    def test_lookups_paced(self, mock_find, mock_sleep, pattern_re, num_workers):
+        """The pre-pass keeps the workers' overall rate, however many threads run it."""
+        names = ["DOE,JANE_R_020326_CXR.pdf", "SMITH,JOHN_L_120124_CBC.pdf", "ROE,RICHARD_L_120124_CBC.pdf"]
+        interval = _INTER_FILE_SLEEP / num_workers
+
+        _prefetch_patients(FAKE_CONFIG, parse_filenames(names, METATAGS, pattern_re), num_workers,
+                           _Pacer(interval))
+
+        assert mock_find.call_count == 3
+        waits = sorted(c.args[0] for c in mock_sleep.call_args_list)
+        assert waits == pytest.approx([interval, 2 * interval], abs=0.1)
+
+    @patch("src.processor.refresh_if_expiring")
+    @patch("src.processor.find_patient")
+    def test_token_refreshed_before_each_prefetch_call(self, mock_find, mock_refresh, mock_docs, pattern_re):
+        """A long pre-pass can outlive the token, so it checks expiry before every call, as files do."""
+        names = ["DOE,JANE_R_020326_CXR.pdf", "DOE,JANE_L_020326_CBC.pdf", "SMITH,JOHN_L_120124_CBC.pdf"]
+        order = []
+        mock_refresh.side_effect = lambda config: order.append("refresh")
+        mock_find.side_effect = lambda *args, **kwargs: order.append("lookup") or _found_patient(pid=1)
+        mock_docs.side_effect = lambda config, pid: order.append("documents") or []
+
+        patient_files = _prefetch_patients(FAKE_CONFIG, parse_filenames(names, METATAGS, pattern_re), 1, None)
+        _prefetch_documents(FAKE_CONFIG, patient_files, 1, None)
+
+        assert order == ["refresh", "lookup", "refresh", "lookup", "refresh", "documents"]
+        mock_refresh.assert_called_with(FAKE_CONFIG)
+
+    @patch("src.processor.time.sleep")
+    @patch("src.processor.find_patient")
+    def test_document_fetches_share_lookup_pacer(self, mock_find, mock_sleep, mock_docs, pattern_re):
+        """Document listings continue on the lookups' schedule instead of bursting after them."""
+        names = ["DOE,JANE_R_020326_CXR.pdf", "DOE,JANE_L_020326_CBC.pdf",
+                 "SMITH,JOHN_R_020326_CXR.pdf", "SMITH,JOHN_L_120124_CBC.pdf"]
+        mock_find.side_effect = lambda config, last, first, middle, dob=None: (
+            _found_patient(pid=1 if last == "DOE" else 2)
+        )
+        pacer = _Pacer(_INTER_FILE_SLEEP)
+
+        patient_files = _prefetch_patients(FAKE_CONFIG, parse_filenames(names, METATAGS, pattern_re), 1, pacer)
+        _prefetch_documents(FAKE_CONFIG, patient_files, 1, pacer)
+
+        assert mock_docs.call_count == 2
+        waits = [c.args[0] for c in mock_sleep.call_args_list]
+        # sleep is patched, so the clock stands still and each wait covers the slots before it
+        assert waits == pytest.approx([_INTER_FILE_SLEEP * n for n in (1, 2, 3)], abs=0.1)
+
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    @patch("src.processor.find_patient")
+    @patch("src.processor.get_patient_documents")
+    def test_documents_prefetched_per_found_patient(self, mock_docs, mock_find, mock_dup, mock_upload, tmp_path, pattern_re):
+        (tmp_path / "DOE,JANE_R_020326_CXR.pdf").write_text("fake")
+        (tmp_path / "DOE,JANE_L_020326_CBC.pdf").write_text("fake")
+        (tmp_path / "SMITH,JOHN_L_120124_CBC.pdf").write_text("fake")
+        mock_find.side_effect = lambda config, last, first, middle, dob=None: (
+            _found_patient(pid=1) if last == "DOE" else _not_found()
+        )
+        mock_docs.return_value = []
+
+        process_directory(FAKE_CONFIG, str(tmp_path), METATAGS, pattern_re, dry_run=True, num_workers=2)
+
+        mock_docs.assert_called_once_with(FAKE_CONFIG, 1)
+
+    @patch("src.processor.upload_document")
+    @patch("src.processor.is_duplicate", return_value=False)
+    @patch("src.processor.find_patient")
+    @patch("src.processor.get_patient_documents")
+    def test_single_file_patient_not_prefetched(self, mock_docs, mock_find, mock_dup, mock_upload, tmp_path, pattern_re):
+        (tmp_path / "DOE,JANE_R_020326_CXR.pdf").write_text("fake")
+        (tmp_path / "SMITH,JOHN_L_120124_CBC.pdf").write_text("fake")
+        mock_find.side_effect = lambda config, last, first, middle, dob=None: (
+            _found_patient(pid=1 if last == "DOE" else 2)
+        )
+
+        process_directory(FAKE_CONFIG, str(tmp_path), METATAGS, pattern_re, dry_run=True)
+
+        mock_docs.assert_not_called()
+        assert mock_dup.call_count == 2
@@ -1,7 +1,9 @@
 """Tests for rate-limit handling: retry logic, backoff, and RateLimitError."""
 
-import json
-from unittest.mock import MagicMock, call, patch
+import datetime
+import email.utils
+import threading
+import time
 
 import pytest
 
@@ -15,25 +17,24 @@ from src.api import (
     upload_document,
 )
 from src.types import PatientLookupStatus, UploadStatus
+from tests.fakes import mock_response
 
 FAKE_CONFIG = {"access_token": "test-token"}
 
+# Responses reused across tests; nothing under test mutates them
+_OK = mock_response({"ok": True})
+_CREATED = mock_response({"id": 999}, status_code=201)
+_THROTTLED = mock_response(status_code=429)
+_RETRY_AFTER_1 = mock_response(status_code=429, headers={"Retry-After": "1"})
+_RETRY_AFTER_2 = mock_response(status_code=429, headers={"Retry-After": "2"})
 
-def _mock_response(status_code=200, json_data=None, headers=None):
-    resp = MagicMock()
-    resp.status_code = status_code
-    resp.json.return_value = json_data or {}
-    resp.text = json.dumps(json_data or {})
-    resp.headers = headers or {}
-    resp.raise_for_status.return_value = None
-    return resp
 
-
-@pytest.fixture(autouse=True)
-def _clear_caches():
-    api._patient_cache.clear()
-    api._documents_cache.clear()
-    yield
+@pytest.fixture
+def sleep_calls(monkeypatch):
+    """Record backoff sleeps instead of waiting them out."""
+    calls = []
+    monkeypatch.setattr(api.time, "sleep", calls.append)
+    return calls
 
 
 # -----------------------------------------------------------------------
@@ -41,108 +42,111 @@ def _clear_caches():
 # -----------------------------------------------------------------------
 
 class TestRequestWithRetry:
-    @patch("src.api.requests.request")
     def test_success_on_first_try(self, mock_request):
         """Non-429 response returned immediately without retries."""
-        mock_request.return_value = _mock_response(200, {"ok": True})
+        mock_request.return_value = _OK
         resp = _request_with_retry("GET", "https://example.com/api")
         assert resp.status_code == 200
         assert mock_request.call_count == 1
 
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_retries_on_429_then_succeeds(self, mock_request, mock_sleep):
-        """429 on first attempt, success on second — should retry once."""
-        mock_request.side_effect = [
-            _mock_response(429, headers={"Retry-After": "1"}),
-            _mock_response(200, {"ok": True}),
-        ]
+    @pytest.mark.parametrize("throttled, waits", [
+        # Each (low, high) bounds one backoff sleep; jitter adds up to a second
+        pytest.param((_RETRY_AFTER_1,), [(1.0, 2.0)], id="retry_after"),
+        pytest.param((mock_response(status_code=429, headers={"Retry-After": "5"}),), [(5.0, 6.0)], id="retry_after_5"),
+        pytest.param((_THROTTLED, _THROTTLED), [(2.0, 3.0), (4.0, 5.0)], id="exponential_without_retry_after"),
+        pytest.param((mock_response(status_code=429, headers={"Retry-After": "soon"}),), [(2.0, 3.0)],
+                     id="unreadable_retry_after"),
+        pytest.param((mock_response(status_code=429, headers={"Retry-After": "999"}),),
+                     [(api.BACKOFF_MAX, api.BACKOFF_MAX + 1.0)], id="capped_at_max"),
+    ])
+    def test_backoff_then_succeeds(self, mock_request, sleep_calls, throttled, waits):
+        """Each 429 is followed by one bounded sleep, then the retry goes through."""
+        mock_request.side_effect = [*throttled, _OK]
         resp = _request_with_retry("GET", "https://example.com/api")
         assert resp.status_code == 200
-        assert mock_request.call_count == 2
-        assert mock_sleep.call_count == 1
+        assert (mock_request.call_count, len(sleep_calls)) == (len(throttled) + 1, len(waits))
+        for slept, (low, high) in zip(sleep_calls, waits):
+            assert low <= slept <= high
 
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_exhausts_retries_raises_rate_limit_error(self, mock_request, mock_sleep):
+    def test_exhausts_retries_raises_rate_limit_error(self, mock_request, sleep_calls):
         """All retries exhausted raises RateLimitError."""
-        mock_request.return_value = _mock_response(429, headers={"Retry-After": "2"})
+        mock_request.return_value = _RETRY_AFTER_2
         with pytest.raises(RateLimitError, match="rate limit"):
             _request_with_retry("GET", "https://example.com/api")
-        # 1 initial + MAX_RETRIES retries
-        assert mock_request.call_count == MAX_RETRIES + 1
-        # Sleeps happen before each retry (not before the final raise)
-        assert mock_sleep.call_count == MAX_RETRIES
-
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_uses_retry_after_header(self, mock_request, mock_sleep):
-        """Retry-After header value is respected (plus jitter)."""
-        mock_request.side_effect = [
-            _mock_response(429, headers={"Retry-After": "5"}),
-            _mock_response(200, {"ok": True}),
-        ]
-        resp = _request_with_retry("GET", "https://example.com/api")
-        assert resp.status_code == 200
-        # Sleep should be at least 5 seconds (Retry-After) but capped at BACKOFF_MAX + jitter
-        actual_sleep = mock_sleep.call_args[0][0]
-        assert actual_sleep >= 5.0
-
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_exponential_backoff_without_retry_after(self, mock_request, mock_sleep):
-        """Without Retry-After header, uses exponential backoff."""
-        mock_request.side_effect = [
-            _mock_response(429),  # no Retry-After
-            _mock_response(429),
-            _mock_response(200, {"ok": True}),
-        ]
-        resp = _request_with_retry("GET", "https://example.com/api")
-        assert resp.status_code == 200
-        # First retry: base * 2^0 = 2s + jitter; second: base * 2^1 = 4s + jitter
-        first_sleep = mock_sleep.call_args_list[0][0][0]
-        second_sleep = mock_sleep.call_args_list[1][0][0]
-        assert first_sleep >= 2.0
-        assert second_sleep >= 4.0
-
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_app_limit_detected_with_large_retry_after(self, mock_request, mock_sleep):
+        # 1 initial + MAX_RETRIES retries; sleeps happen before each retry (not before the final raise)
+        assert (mock_request.call_count, len(sleep_calls)) == (MAX_RETRIES + 1, MAX_RETRIES)
+
+    def test_app_limit_detected_with_large_retry_after(self, mock_request, sleep_calls):
         """Retry-After > 60 indicates application-level limit."""
-        mock_request.return_value = _mock_response(429, headers={"Retry-After": "3600"})
+        mock_request.return_value = mock_response(status_code=429, headers={"Retry-After": "3600"})
         with pytest.raises(RateLimitError) as exc_info:
             _request_with_retry("GET", "https://example.com/api")
         assert exc_info.value.is_app_limit is True
         assert "500 requests/hour" in str(exc_info.value)
 
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_system_limit_not_flagged_as_app_limit(self, mock_request, mock_sleep):
+    def test_http_date_retry_after(self, mock_request, sleep_calls):
+        """Retry-After may be an HTTP-date instead of a number of seconds."""
+        reset = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        mock_request.return_value = mock_response(
+            status_code=429, headers={"Retry-After": email.utils.format_datetime(reset, usegmt=True)}
+        )
+        with pytest.raises(RateLimitError) as exc_info:
+            _request_with_retry("GET", "https://example.com/api")
+        assert exc_info.value.is_app_limit is True
+        assert 3500 < exc_info.value.retry_after <= 3600
+
+    def test_system_limit_not_flagged_as_app_limit(self, mock_request, sleep_calls):
         """Small Retry-After is not flagged as application-level limit."""
-        mock_request.return_value = _mock_response(429, headers={"Retry-After": "2"})
+        mock_request.return_value = _RETRY_AFTER_2
         with pytest.raises(RateLimitError) as exc_info:
             _request_with_retry("GET", "https://example.com/api")
         assert exc_info.value.is_app_limit is False
 
-    @patch("src.api.requests.request")
+    def test_retry_notice_goes_to_current_sink(self, mock_request, sleep_calls, capsys):
+        """The backoff notice goes to the sink set for this thread, not stdout."""
+        mock_request.side_effect = [_RETRY_AFTER_1, _OK]
+        notices = []
+        token = api.retry_log.set(notices.append)
+        try:
+            _request_with_retry("GET", "https://example.com/api")
+        finally:
+            api.retry_log.reset(token)
+        assert len(notices) == 1 and notices[0].startswith("[RATE LIMIT] 429 received")
+        assert capsys.readouterr().out == ""
+
     def test_non_429_error_not_retried(self, mock_request):
         """Non-429 errors (e.g. 500) are returned immediately, not retried."""
-        mock_request.return_value = _mock_response(500)
+        mock_request.return_value = mock_response(status_code=500)
         resp = _request_with_retry("GET", "https://example.com/api")
         assert resp.status_code == 500
         assert mock_request.call_count == 1
 
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_backoff_capped_at_max(self, mock_request, mock_sleep):
-        """Sleep time never exceeds BACKOFF_MAX + jitter."""
-        mock_request.side_effect = [
-            _mock_response(429, headers={"Retry-After": "999"}),
-            _mock_response(200, {"ok": True}),
+    def test_concurrent_requests_bounded(self, monkeypatch):
+        """No more than MAX_CONCURRENT_REQUESTS calls are in flight at once."""
+        lock = threading.Lock()
+        in_flight = 0
+        peak = 0
+
+        def _slow_request(method, url, **kwargs):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight -= 1
+            return mock_response()
+
+        monkeypatch.setattr(api.session, "request", _slow_request)
+        threads = [
+            threading.Thread(target=_request_with_retry, args=("GET", "https://example.com/api"))
+            for _ in range(api.MAX_CONCURRENT_REQUESTS * 3)
         ]
-        _request_with_retry("GET", "https://example.com/api")
-        actual_sleep = mock_sleep.call_args[0][0]
-        assert actual_sleep <= api.BACKOFF_MAX + 1.0  # max + jitter ceiling
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert peak <= api.MAX_CONCURRENT_REQUESTS
 
 
 # -----------------------------------------------------------------------
@@ -150,13 +154,11 @@ class TestRequestWithRetry:
 # -----------------------------------------------------------------------
 
 class TestFindPatientRateLimit:
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_find_patient_retries_on_429(self, mock_request, mock_sleep):
+    def test_find_patient_retries_on_429(self, mock_request, sleep_calls):
         """find_patient succeeds after a transient 429."""
         mock_request.side_effect = [
-            _mock_response(429, headers={"Retry-After": "1"}),
-            _mock_response(200, {"results": [
+            _RETRY_AFTER_1,
+            mock_response({"results": [
                 {"id": 42, "doctor": 7, "first_name": "JANE", "last_name": "DOE"},
             ]}),
         ]
@@ -164,10 +166,8 @@ class TestFindPatientRateLimit:
         assert result.status == PatientLookupStatus.FOUND
         assert result.patient_id == 42
 
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_find_patient_raises_on_exhausted_retries(self, mock_request, mock_sleep):
-        mock_request.return_value = _mock_response(429, headers={"Retry-After": "2"})
+    def test_find_patient_raises_on_exhausted_retries(self, mock_request, sleep_calls):
+        mock_request.return_value = _RETRY_AFTER_2
         with pytest.raises(RateLimitError):
             find_patient(FAKE_CONFIG, "DOE", "JANE")
 
@@ -177,27 +177,38 @@ class TestFindPatientRateLimit:
 # -----------------------------------------------------------------------
 
 class TestUploadDocumentRateLimit:
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_upload_retries_on_429(self, mock_request, mock_sleep, tmp_path):
-        test_file = tmp_path / "test.pdf"
-        test_file.write_text("fake pdf")
+    def test_upload_retries_on_429(self, mock_request, sleep_calls, fake_pdf):
         mock_request.side_effect = [
-            _mock_response(429, headers={"Retry-After": "1"}),
-            _mock_response(201, {"id": 999}),
+            _RETRY_AFTER_1,
+            _CREATED,
         ]
-        result = upload_document(FAKE_CONFIG, str(test_file), 1, 2, "2026-02-03", "CXR", "radiology")
+        result = upload_document(FAKE_CONFIG, fake_pdf, 1, 2, "2026-02-03", "CXR", "radiology")
         assert result.status == UploadStatus.SUCCESS
         assert result.document_id == 999
 
-    @patch("src.api.time.sleep")
-    @patch("src.api.requests.request")
-    def test_upload_raises_on_exhausted_retries(self, mock_request, mock_sleep, tmp_path):
-        test_file = tmp_path / "test.pdf"
-        test_file.write_text("fake pdf")
-        mock_request.return_value = _mock_response(429, headers={"Retry-After": "2"})
+    def test_upload_retry_resends_full_document(self, mock_request, sleep_calls, fake_pdf):
+        """Each attempt streams the whole file, not an exhausted handle."""
+        bodies = []
+        responses = iter([
+            _RETRY_AFTER_1,
+            _CREATED,
+        ])
+
+        def _capture(method, url, **kwargs):
+            bodies.append(kwargs["data"].to_string())
+            assert kwargs["headers"]["Content-Type"].startswith("multipart/form-data")
+            return next(responses)
+
+        mock_request.side_effect = _capture
+        upload_document(FAKE_CONFIG, fake_pdf, 1, None, "2026-02-03", "CXR", "radiology")
+        assert len(bodies) == 2
+        assert all(b"fake pdf" in body for body in bodies)
+        assert all(b'name="doctor"' not in body for body in bodies)
+
+    def test_upload_raises_on_exhausted_retries(self, mock_request, sleep_calls, fake_pdf):
+        mock_request.return_value = _RETRY_AFTER_2
         with pytest.raises(RateLimitError):
-            upload_document(FAKE_CONFIG, str(test_file), 1, 2, "2026-02-03", "CXR", "radiology")
+            upload_document(FAKE_CONFIG, fake_pdf, 1, 2, "2026-02-03", "CXR", "radiology")
 
 
 # -----------------------------------------------------------------------